@@ -4,6 +4,7 @@ import signal
 
 from metahosting.common import \
     argument_parsing, logging_setup, config_manager as cm
+from workers.supervisor import supervise
 
 
 def run():
@@ -20,6 +21,14 @@ def run():
     config['messaging'] = cm.get_configuration('messaging')
     config['worker'] = cm.get_configuration('worker')
     config['instance'] = cm.get_instance_configuration('instance_environment')
+    processes = int(config['worker'].get('processes', 1))
+    if processes > 1:
+        supervise(config, start_worker, processes)
+    else:
+        start_worker(config)
+
+
+def start_worker(config):
     persistence = cm.get_backend_class(config=config['persistence'],
                                        key='backend')
     messaging = cm.get_backend_class(config=config['messaging'],
@@ -33,6 +42,7 @@ def run():
     signal.signal(signal.SIGTERM, worker.stop)
     signal.signal(signal.SIGHUP, worker.stop)
     signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGUSR1, worker.profiler.toggle)
     worker.start()
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+"""
+micro-benchmark of the bitmap PortManager against the former set based
+implementation on a wide port range
+
+run with: python -m tests.benchmark_port_manager
+"""
+import timeit
+
+from workers.manager.port import PortManager
+
+CONFIG = {'ports': '10000:60000'}
+PORTS_PER_INSTANCE = 3
+INSTANCES = 5000
+
+
+class SetPortManager():
+    """
+    the set based implementation PortManager replaced
+    """
+
+    def __init__(self, worker_conf):
+        start, end = worker_conf['ports'].split(':')
+        self.port_range = frozenset(range(int(start), int(end) + 1))
+        self.used_ports = set()
+
+    def acquire_ports(self, count):
+        available_ports = set(self.port_range.difference(self.used_ports))
+        if count <= len(available_ports):
+            acquired_ports = []
+            for item in range(0, count):
+                port = available_ports.pop()
+                self.used_ports.add(port)
+                acquired_ports.append(port)
+            return acquired_ports
+        return None
+
+    def enough_ports_left(self, count):
+        if count > len(set(self.port_range.difference(self.used_ports))):
+            return False
+        else:
+            return True
+
+    def release_ports(self, ports):
+        for port in ports:
+            self.used_ports.discard(port)
+
+
+def fill(manager):
+    acquired = list()
+    for unused in range(INSTANCES):
+        acquired.append(manager.acquire_ports(PORTS_PER_INSTANCE))
+    return acquired
+
+
+def run(manager_class):
+    manager = manager_class(CONFIG)
+    acquired = fill(manager)
+    results = dict()
+    results['acquire+release'] = min(timeit.repeat(
+        lambda: manager.release_ports(
+            manager.acquire_ports(PORTS_PER_INSTANCE)),
+        number=100, repeat=3)) / 100
+    results['enough_ports_left'] = min(timeit.repeat(
+        lambda: manager.enough_ports_left(PORTS_PER_INSTANCE),
+        number=100, repeat=3)) / 100
+    results['churn'] = min(timeit.repeat(
+        lambda: [manager.release_ports(ports) or
+                 manager.acquire_ports(PORTS_PER_INSTANCE)
+                 for ports in acquired[:100]],
+        number=1, repeat=3)) / 100
+    return results
+
+
+def main():
+    print('range {}, {} instances with {} ports in use'.format(
+        CONFIG['ports'], INSTANCES, PORTS_PER_INSTANCE))
+    print('{:>18} {:>14} {:>14}'.format(
+        'operation', 'set (us)', 'bitmap (us)'))
+    old = run(SetPortManager)
+    new = run(PortManager)
+    for operation in sorted(old):
+        print('{:>18} {:>14.2f} {:>14.2f}'.format(
+            operation, old[operation] * 1e6, new[operation] * 1e6))
+
+
+if __name__ == '__main__':
+    main()
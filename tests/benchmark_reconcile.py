@@ -0,0 +1,69 @@
+"""
+compare docker requests and duration of a reconcile tick between inspecting
+every container and deriving everything from one container listing
+
+run with: python -m tests.benchmark_reconcile
+"""
+import time
+
+from tests.fakes import FIRST_PORT, build_worker
+from workers.docker_worker import _is_running
+from workers.manager.persistence import INSTANCE_STATUS
+
+SIZES = (1000, 10000)
+
+
+def build_reconciled_worker(count):
+    worker, client = build_worker('docker', count, {})
+    for number in range(count):
+        container_id = client.add_container(ports=[FIRST_PORT + number])
+        worker.local_persistence.set_instance(
+            str(number), {'id': str(number),
+                          'container_id': container_id,
+                          'status': INSTANCE_STATUS.RUNNING})
+    return worker, client
+
+
+def inspect_tick(worker):
+    """
+    the tick as it was before the container index: inspect per instance,
+    again for its networking and once more per container for the ports
+    """
+    instances = worker.local_persistence.get_instances()
+    for instance in instances.values():
+        container = worker._get_container(instance['container_id'])
+        if container and _is_running(container):
+            worker._set_networking(instance)
+            worker.local_persistence.update_instance_status(
+                instance, INSTANCE_STATUS.RUNNING)
+    used_ports = set()
+    for container in worker.docker.containers():
+        used_ports.update(worker._get_container_ports(container['Id']))
+    worker.port_manager.update_used_ports(used_ports)
+    worker._update_worker_status()
+
+
+def index_tick(worker):
+    worker._publish_updates()
+
+
+def measure(tick, worker, client):
+    client.reset_calls()
+    started = time.time()
+    tick(worker)
+    return client.request_count, time.time() - started
+
+
+def main():
+    print('{:>8} {:>10} {:>10} {:>10}'.format(
+        'size', 'path', 'requests', 'seconds'))
+    for size in SIZES:
+        worker, client = build_reconciled_worker(size)
+        for name, tick in (('inspect', inspect_tick), ('index', index_tick)):
+            requests, seconds = measure(tick, worker, client)
+            print('{:>8} {:>10} {:>10} {:>10.3f}'.format(
+                size, name, requests, seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+benchmark GenericUrlBuilder against the former linear template scan over
+thousands of port mappings, once cold and once with memoized results
+
+run with: python -m tests.benchmark_url_builder
+"""
+import time
+
+from furl import furl
+
+from urlbuilders import GenericUrlBuilder
+
+FORMAT = 'http://localhost:7474;https://localhost:7473;' \
+         'http://localhost:8080/exist'
+MAPPINGS = 5000
+
+
+class LegacyUrlBuilder(object):
+    """
+    the implementation GenericUrlBuilder replaced
+    """
+
+    def __init__(self, worker_conf):
+        self.service_url = dict()
+        for url in worker_conf['formatting_string'].split(';'):
+            self.service_url[url] = furl(url)
+
+    def build(self, port_mapping):
+        urls = list()
+        for internal_port in port_mapping.keys():
+            for index, unused in enumerate(port_mapping[internal_port]):
+                endpoint = port_mapping[internal_port][index]
+                port, proto = internal_port.split('/')
+                tmp_url = None
+                for item in self.service_url.keys():
+                    if int(port) == self.service_url[item].port:
+                        tmp_url = self.service_url[item].copy()
+                        tmp_url.port = int(endpoint['HostPort'])
+                        tmp_url.host = endpoint['HostIp']
+                        break
+                if not tmp_url:
+                    tmp_url = furl('http://{}:{}'.format(
+                        endpoint['HostIp'], endpoint['HostPort']))
+                urls.append(str(tmp_url))
+        return urls
+
+
+def get_mappings():
+    mappings = list()
+    for number in range(MAPPINGS):
+        port = 10000 + 3 * number
+        mappings.append(dict(
+            (u'{}/tcp'.format(internal),
+             [{u'HostIp': u'10.0.0.1', u'HostPort': u'{}'.format(port + i)}])
+            for i, internal in enumerate((7474, 7473, 9999))))
+    return mappings
+
+
+def measure(builder, mappings):
+    started = time.time()
+    for mapping in mappings:
+        builder.build(mapping)
+    return time.time() - started
+
+
+def main():
+    mappings = get_mappings()
+    conf = {'formatting_string': FORMAT, 'url_cache_size': MAPPINGS}
+    legacy = LegacyUrlBuilder(conf)
+    builder = GenericUrlBuilder(conf)
+    print('{} mappings with 3 ports each'.format(MAPPINGS))
+    print('{:>10} {:>10} {:>10}'.format('builder', 'pass', 'seconds'))
+    for name, instance in (('legacy', legacy), ('compiled', builder)):
+        for run in ('cold', 'warm'):
+            print('{:>10} {:>10} {:>10.3f}'.format(
+                name, run, measure(instance, mappings)))
+
+
+if __name__ == '__main__':
+    main()
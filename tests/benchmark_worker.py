@@ -0,0 +1,168 @@
+"""
+benchmark harness driving DockerWorker and DummyWorker against the
+in-process fakes of tests.fakes: a create storm, steady state reconcile
+ticks and a delete storm per worker type and instance count. Results are
+printed (or written) as JSON, and can be checked against a previous run.
+
+run with: python -m tests.benchmark_worker --sizes 100,1000,10000
+          python -m tests.benchmark_worker --option dispatch_threads=8
+          python -m tests.benchmark_worker --option message_codec=msgpack+zlib
+          python -m tests.benchmark_worker --baseline old.json
+"""
+import argparse
+import json
+import logging
+import resource
+import sys
+import time
+
+from mock import patch
+
+from tests.fakes import build_worker, make_message
+
+TICKS = 3
+# result keys where a higher value is a regression
+TIMINGS = ('seconds', 'tick_seconds')
+
+
+def get_counters(worker, client):
+    counters = {'store': dict(worker.local_persistence.instances.calls),
+                'published': len(worker.publish_manager.published),
+                'published_bytes': worker.publish_manager.published_bytes}
+    if client is not None:
+        counters['docker'] = dict(client.calls)
+    return counters
+
+
+def get_difference(before, after):
+    difference = dict()
+    for key, value in after.items():
+        if isinstance(value, dict):
+            difference[key] = dict(
+                (call, count - before.get(key, {}).get(call, 0))
+                for call, count in value.items()
+                if count != before.get(key, {}).get(call, 0))
+        else:
+            difference[key] = value - before.get(key, 0)
+    return difference
+
+
+def storm(worker, client, subject, ids):
+    """
+    dispatch one message per id and wait until all are handled
+    """
+    before = get_counters(worker, client)
+    started = time.time()
+    for instance_id in ids:
+        worker._dispatch(make_message(subject, id=instance_id))
+    if worker._pool:
+        worker._pool.join()
+    seconds = time.time() - started
+    result = get_difference(before, get_counters(worker, client))
+    result['seconds'] = seconds
+    result['per_second'] = len(ids) / seconds if seconds else None
+    return result
+
+
+def ticks(worker, client):
+    """
+    run reconcile ticks, the first one moves the new instances to running
+    """
+    results = list()
+    for unused in range(TICKS):
+        before = get_counters(worker, client)
+        started = time.time()
+        worker._publish_updates()
+        result = get_difference(before, get_counters(worker, client))
+        result['tick_seconds'] = time.time() - started
+        results.append(result)
+    return {'first': results[0], 'steady': results[-1]}
+
+
+def run(kind, size, options):
+    worker, client = build_worker(kind, size, options)
+    ids = [str(number) for number in range(size)]
+    result = {'worker': kind, 'size': size, 'options': options}
+    result['create'] = storm(worker, client, 'create_instance', ids)
+    result['ticks'] = ticks(worker, client)
+    result['delete'] = storm(worker, client, 'delete_instance', ids)
+    result['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if worker._pool:
+        worker._pool.shutdown()
+    return result
+
+
+def get_regressions(results, baseline, tolerance):
+    """
+    compare the timings with a previous run
+    :return: list of strings describing the timings that got slower by more
+    than tolerance
+    """
+    previous = dict(((item['worker'], item['size']), item)
+                    for item in baseline)
+    regressions = list()
+    for result in results:
+        old = previous.get((result['worker'], result['size']))
+        if old is None:
+            continue
+        for path, value in _get_timings(result):
+            old_value = dict(_get_timings(old)).get(path)
+            if old_value and value > old_value * (1 + tolerance):
+                regressions.append('{} {} {}: {:.3f}s -> {:.3f}s'.format(
+                    result['worker'], result['size'], path, old_value, value))
+    return regressions
+
+
+def _get_timings(result, prefix=''):
+    for key, value in sorted(result.items()):
+        if isinstance(value, dict):
+            for item in _get_timings(value, prefix + key + '.'):
+                yield item
+        elif key in TIMINGS:
+            yield prefix + key, value
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        help='comma separated instance counts')
+    parser.add_argument('--workers', default='docker,dummy',
+                        help='comma separated worker types')
+    parser.add_argument('--option', action='append', default=[],
+                        help='worker config item as key=value')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown against the baseline')
+    parser.add_argument('--verbose', action='store_true',
+                        help='keep the worker logging enabled')
+    arguments = parser.parse_args(arguments)
+    if not arguments.verbose:
+        logging.disable(logging.CRITICAL)
+    options = dict(item.split('=', 1) for item in arguments.option)
+
+    results = list()
+    with patch('workers.dummy_worker.time.sleep'):
+        for kind in arguments.workers.split(','):
+            for size in arguments.sizes.split(','):
+                results.append(run(kind, int(size), options))
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            regressions = get_regressions(results, json.load(baseline_file),
+                                          arguments.tolerance)
+        for regression in regressions:
+            sys.stderr.write('regression: {}\n'.format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+in-process stand-ins for the docker daemon, the persistence store and the
+messaging backend, used by the tests and benchmarks to drive workers
+without any external service
+"""
+import itertools
+import json
+
+from collections import defaultdict
+
+import docker.errors
+import requests
+from mock import patch
+
+from workers.docker_worker import DockerWorker
+from workers.dummy_worker import DummyWorker
+
+FIRST_PORT = 10000
+
+
+class FakeDockerClient(object):
+    """
+    keeps containers in memory and counts every API request it serves
+    """
+
+    def __init__(self, exposed_ports=('8080',), host_ip=u'0.0.0.0'):
+        self.exposed_ports = list(exposed_ports)
+        self.host_ip = host_ip
+        self.containers_by_id = dict()
+        self.calls = defaultdict(int)
+        self._ids = itertools.count()
+
+    @property
+    def request_count(self):
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    def add_container(self, ports=None, running=True, labels=None):
+        """
+        register a container without going through the API
+        :param ports: list of host ports, one per exposed port
+        :param running: bool, state of the container
+        :param labels: dict, labels of the container
+        :return: id of the container
+        """
+        container_id = '{:064x}'.format(next(self._ids))
+        bindings = dict()
+        for private, public in zip(self.exposed_ports, ports or []):
+            bindings[private] = public
+        self.containers_by_id[container_id] = {
+            'Id': container_id, 'Running': running, 'Started': running,
+            'Bindings': bindings, 'Labels': labels or {}}
+        return container_id
+
+    def import_image(self, **kwargs):
+        self.calls['import_image'] += 1
+
+    def inspect_image(self, image):
+        self.calls['inspect_image'] += 1
+        exposed = dict((u'{}/tcp'.format(port), {})
+                       for port in self.exposed_ports)
+        return {u'Id': image, u'ContainerConfig': {u'ExposedPorts': exposed}}
+
+    def containers(self, all=False, filters=None, **kwargs):
+        self.calls['containers'] += 1
+        label = (filters or {}).get('label')
+        listing = list()
+        for container in self.containers_by_id.values():
+            if not all and not container['Running']:
+                continue
+            if label and label not in ['{}={}'.format(key, value) for
+                                       key, value in
+                                       container['Labels'].items()]:
+                continue
+            ports = list()
+            for private, public in container['Bindings'].items():
+                if container['Running']:
+                    ports.append({'IP': self.host_ip,
+                                  'PrivatePort': int(private),
+                                  'PublicPort': int(public),
+                                  'Type': 'tcp'})
+            if container['Running']:
+                status = 'Up 5 minutes'
+            elif container['Started']:
+                status = 'Exited (0) 5 minutes ago'
+            else:
+                status = 'Created'
+            listing.append({'Id': container['Id'], 'Status': status,
+                            'Ports': ports, 'Labels': container['Labels']})
+        return listing
+
+    def inspect_container(self, container):
+        self.calls['inspect_container'] += 1
+        container = self._lookup(container)
+        ports = dict()
+        for private, public in container['Bindings'].items():
+            ports[u'{}/tcp'.format(private)] = [
+                {u'HostIp': self.host_ip, u'HostPort': u'{}'.format(public)}]
+        return {'Id': container['Id'],
+                'State': {'Running': container['Running']},
+                'NetworkSettings': {'Ports': ports}}
+
+    def create_container(self, image, ports=None, labels=None, **kwargs):
+        self.calls['create_container'] += 1
+        return {'Id': self.add_container(running=False, labels=labels)}
+
+    def start(self, container, port_bindings=None, **kwargs):
+        self.calls['start'] += 1
+        container = self._lookup(container)
+        container['Bindings'] = dict(port_bindings or {})
+        container['Running'] = True
+        container['Started'] = True
+
+    def kill(self, container):
+        self.calls['kill'] += 1
+        self._lookup(container)['Running'] = False
+
+    def remove_container(self, container, **kwargs):
+        self.calls['remove_container'] += 1
+        self.containers_by_id.pop(self._lookup(container)['Id'])
+
+    def events(self, **kwargs):
+        self.calls['events'] += 1
+        return iter([])
+
+    def _lookup(self, container):
+        if isinstance(container, dict):
+            container = container['Id']
+        if container not in self.containers_by_id:
+            raise docker.errors.APIError('No such container',
+                                         _get_response(404))
+        return self.containers_by_id[container]
+
+
+class FakeStore(object):
+    """
+    dict based replacement for a metahosting persistence store
+    """
+
+    def __init__(self, config=None):
+        self.data = dict()
+        self.calls = defaultdict(int)
+
+    def get(self, key):
+        self.calls['get'] += 1
+        return self.data.get(key)
+
+    def get_all(self):
+        self.calls['get_all'] += 1
+        return dict(self.data)
+
+    def update(self, key, value):
+        self.calls['update'] += 1
+        self.data[key] = value
+
+
+class FakeMessaging(object):
+    """
+    messaging backend that records published messages
+    """
+
+    def __init__(self, config=None, queue=None):
+        self.queue = queue
+        self.published = list()
+        self.published_bytes = 0
+
+    def publish(self, queue, subject, message):
+        self.published.append((queue, subject, message))
+        self.published_bytes += len(json.dumps(message, default=str))
+
+    def subscribe(self, queue, callback):
+        self.callback = callback
+
+    def disconnect(self):
+        pass
+
+
+def _get_response(status_code):
+    """
+    response of the docker daemon as docker.errors.APIError expects it
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = b''
+    return response
+
+
+def make_message(subject, **body):
+    """
+    build a message as the messaging backend hands it to Worker._dispatch
+    """
+    body['subject'] = subject
+    return body
+
+
+def get_config(size, options):
+    worker = {'name': 'bench',
+              'description': 'benchmark worker',
+              'uuid_source': '/sys/class/dmi/id/product_uuid',
+              'ip': '10.0.0.1',
+              'image': 'bench:latest',
+              'docker_url': 'unix:///var/run/docker.sock',
+              'formatting_string': 'http://localhost:8080/bench',
+              'ports': '{}:{}'.format(FIRST_PORT, FIRST_PORT + 2 * size)}
+    worker.update(options)
+    return {'worker': worker,
+            'persistence': {},
+            'messaging': {},
+            'instance': {'password': '', 'port': 'INJECT_PORT'}}
+
+
+def build_worker(kind, size, options):
+    """
+    :return: the worker and the fake docker client, None for DummyWorker
+    """
+    config = get_config(size, options)
+    if kind == 'dummy':
+        worker = DummyWorker(config=config,
+                             persistence=FakeStore,
+                             messaging=FakeMessaging)
+        return worker, None
+    client = FakeDockerClient()
+    with patch('workers.docker_client.AutoVersionClient',
+               return_value=client):
+        worker = DockerWorker(config=config,
+                              persistence=FakeStore,
+                              messaging=FakeMessaging)
+    return worker, client
@@ -0,0 +1,157 @@
+"""
+replay a message recording of a worker (see capture_file) against
+DockerWorker or DummyWorker with the in-process fakes of tests.fakes, at
+the recorded pace, faster, or as fast as possible. Throughput and the
+latency percentiles per subject are printed (or written) as JSON; the
+latency of a message runs from its dispatch to the end of its callback, so
+it includes the time spent waiting for a dispatch thread.
+
+run with: python -m tests.replay messages.rec
+          python -m tests.replay messages.rec --speed 10 --worker dummy
+          python -m tests.replay messages.rec --speed 0 \
+                --option dispatch_threads=8
+"""
+import argparse
+import json
+import logging
+import math
+import sys
+import threading
+import time
+
+from collections import defaultdict
+from time import sleep
+
+from mock import patch
+
+from tests.fakes import build_worker
+from workers import _get_batch
+from workers.capture import read_recording
+
+PERCENTILES = (50, 90, 99)
+
+
+def get_size(messages):
+    """
+    :return: number of instances the recording creates, to size the port
+    range of the worker
+    """
+    size = 0
+    for unused, message in messages:
+        subject = message.get('subject')
+        if subject == 'create_instance':
+            size += 1
+        elif subject == 'create_instances':
+            size += len(_get_batch(message))
+    return max(size, 1)
+
+
+def get_percentile(values, percentile):
+    """
+    nearest rank percentile
+    :param values: sorted list
+    """
+    rank = int(math.ceil(percentile / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def replay(worker, messages, speed):
+    """
+    dispatch the messages to the worker and wait until all are handled
+    :param messages: list of (timestamp, message) tuples
+    :param speed: factor the recorded pace is sped up by, 0 for as fast as
+    possible
+    :return: dict with the results
+    """
+    dispatched = dict()
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    run_callback = worker._run_callback
+
+    def timed_callback(subject, message):
+        try:
+            run_callback(subject, message)
+        except Exception:
+            logging.exception('Replayed %s failed', subject)
+            with lock:
+                errors[subject] += 1
+        finished = time.time()
+        with lock:
+            latencies[subject].append(
+                finished - dispatched.pop(id(message)))
+
+    worker._run_callback = timed_callback
+    started = time.time()
+    first = messages[0][0] if messages else 0
+    for timestamp, message in messages:
+        if speed:
+            delay = started + (timestamp - first) / speed - time.time()
+            if delay > 0:
+                sleep(delay)
+        with lock:
+            dispatched[id(message)] = time.time()
+        worker._dispatch(message)
+    if worker._pool:
+        worker._pool.join()
+    seconds = time.time() - started
+    worker._run_callback = run_callback
+
+    subjects = dict()
+    for subject, values in latencies.items():
+        values.sort()
+        result = {'count': len(values), 'errors': errors[subject],
+                  'per_second': len(values) / seconds if seconds else None,
+                  'max': values[-1]}
+        for percentile in PERCENTILES:
+            result['p{}'.format(percentile)] = get_percentile(values,
+                                                              percentile)
+        subjects[subject] = result
+    return {'messages': len(messages),
+            'recorded_seconds': messages[-1][0] - first if messages else 0,
+            'seconds': seconds,
+            'per_second': len(messages) / seconds if seconds else None,
+            'subjects': subjects}
+
+
+def run(kind, messages, speed, options):
+    worker, unused = build_worker(kind, get_size(messages), options)
+    result = {'worker': kind, 'speed': speed, 'options': options}
+    result.update(replay(worker, messages, speed))
+    if worker._pool:
+        worker._pool.shutdown()
+    return result
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('recording', help='file written by capture_file')
+    parser.add_argument('--worker', default='docker',
+                        choices=('docker', 'dummy'), help='worker type')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='speed up factor, 0 for as fast as possible')
+    parser.add_argument('--option', action='append', default=[],
+                        help='worker config item as key=value')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--verbose', action='store_true',
+                        help='keep the worker logging enabled')
+    arguments = parser.parse_args(arguments)
+    if not arguments.verbose:
+        logging.disable(logging.CRITICAL)
+    options = dict(item.split('=', 1) for item in arguments.option)
+    messages = list(read_recording(arguments.recording))
+
+    with patch('workers.dummy_worker.time.sleep'):
+        result = run(arguments.worker, messages, arguments.speed, options)
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import threading
+import time
+import unittest
+
+from workers.manager.admission import AdmissionController
+
+
+class AdmissionControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.capacity = 3
+        self.admission = AdmissionController(max_in_flight=2,
+                                             capacity=lambda: self.capacity)
+
+    def test_max_in_flight(self):
+        self.assertTrue(self.admission.admit())
+        self.assertTrue(self.admission.admit())
+        self.assertFalse(self.admission.admit())
+        self.admission.release()
+        self.assertTrue(self.admission.admit())
+
+    def test_capacity(self):
+        self.capacity = 1
+        self.assertEqual(self.admission.free_slots(), 1)
+        self.assertTrue(self.admission.admit())
+        self.assertFalse(self.admission.has_capacity())
+        self.assertFalse(self.admission.admit())
+
+    def test_acquired_create_is_counted_once(self):
+        self.assertTrue(self.admission.admit())
+        self.assertEqual(self.admission.free_slots(), 1)
+        # the capacity now excludes the resources of the create itself
+        self.capacity = 2
+        self.admission.acquired()
+        self.assertEqual(self.admission.free_slots(), 1)
+        self.admission.release()
+        self.assertEqual(self.admission.pending, 0)
+        self.assertEqual(self.admission.in_flight, 0)
+
+    def test_wait_for_in_flight_slot(self):
+        self.assertTrue(self.admission.admit())
+        self.assertTrue(self.admission.admit())
+        admitted = list()
+        thread = threading.Thread(
+            target=lambda: admitted.append(self.admission.admit(wait=True)))
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(admitted, [])
+        self.admission.release()
+        thread.join(5)
+        self.assertEqual(admitted, [True])
+
+    def test_wait_rejects_without_capacity(self):
+        self.capacity = 0
+        self.assertFalse(self.admission.admit(wait=True))
+
+    def test_no_limits(self):
+        admission = AdmissionController(max_in_flight=0,
+                                        capacity=lambda: None)
+        self.assertIsNone(admission.free_slots())
+        self.assertTrue(admission.admit())
+        self.assertTrue(admission.has_capacity())
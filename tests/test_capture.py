@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from tests import replay
+from tests.fakes import build_worker, make_message
+from workers.capture import MessageRecorder, read_recording
+
+
+class MessageRecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'messages.rec')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record_and_read(self):
+        recorder = MessageRecorder(self.path)
+        recorder.record(make_message('create_instance', id='1'))
+        recorder.record(make_message('delete_instance', id='1'))
+        recorder.close()
+        recorder.record(make_message('delete_instance', id='2'))
+        messages = list(read_recording(self.path))
+        self.assertEqual(2, len(messages))
+        self.assertEqual('create_instance', messages[0][1]['subject'])
+        self.assertEqual('1', messages[1][1]['id'])
+        self.assertLessEqual(messages[0][0], messages[1][0])
+
+    def test_append(self):
+        MessageRecorder(self.path).record(make_message('info', id='1'))
+        MessageRecorder(self.path).record(make_message('info', id='2'))
+        self.assertEqual(['1', '2'], [message['id'] for unused, message
+                                      in read_recording(self.path)])
+
+    def test_skip_torn_line(self):
+        with open(self.path, 'w') as recording:
+            recording.write(json.dumps([1.0, {'subject': 'info'}]) + '\n')
+            recording.write('[2.0,{"subj')
+        self.assertEqual([(1.0, {'subject': 'info'})],
+                         list(read_recording(self.path)))
+
+    def test_worker_records_dispatched_messages(self):
+        worker, unused = build_worker('dummy', 1,
+                                      {'capture_file': self.path})
+        worker._dispatch(make_message('unknown_subject', id='1'))
+        worker.recorder.close()
+        self.assertEqual(['unknown_subject'],
+                         [message['subject'] for unused, message
+                          in read_recording(self.path)])
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'messages.rec')
+        with open(self.path, 'w') as recording:
+            for number in range(5):
+                recording.write(json.dumps([100.0 + number, make_message(
+                    'create_instance', id=str(number))]) + '\n')
+            recording.write(json.dumps([105.0, make_message(
+                'delete_instances', ids=['0', '1'])]) + '\n')
+        self.messages = list(read_recording(self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_size(self):
+        self.assertEqual(5, replay.get_size(self.messages))
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(50, replay.get_percentile(values, 50))
+        self.assertEqual(99, replay.get_percentile(values, 99))
+        self.assertEqual(1, replay.get_percentile([1], 90))
+
+    def test_replay_docker(self):
+        result = replay.run('docker', self.messages, 0,
+                            {'dispatch_threads': '2'})
+        self.assertEqual(6, result['messages'])
+        self.assertEqual(5.0, result['recorded_seconds'])
+        self.assertEqual(5, result['subjects']['create_instance']['count'])
+        self.assertEqual(1, result['subjects']['delete_instances']['count'])
+        self.assertEqual(0, result['subjects']['create_instance']['errors'])
+
+    def test_replay_pace(self):
+        with patch('tests.replay.sleep') as sleep:
+            with patch('workers.dummy_worker.time.sleep'):
+                replay.run('dummy', self.messages, 10, {})
+        delays = [call[0][0] for call in sleep.call_args_list]
+        self.assertEqual(5, len(delays))
+        self.assertAlmostEqual(0.5, delays[-1], delta=0.1)
+
+    def test_main_writes_output(self):
+        output = os.path.join(self.directory, 'result.json')
+        with patch('logging.disable'):
+            self.assertEqual(0, replay.main([self.path, '--speed', '0',
+                                             '--worker', 'dummy',
+                                             '--output', output]))
+        with open(output) as result:
+            self.assertEqual('dummy', json.load(result)['worker'])
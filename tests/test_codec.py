@@ -0,0 +1,35 @@
+import unittest
+
+from workers.codec import Codec, decode, get_codec, msgpack
+
+INSTANCE = {'id': '1', 'status': 'running', 'ts': 1.5,
+            'urls': ['http://192.168.1.1:7000'],
+            'environment': ['PASSWORD=secret', 'PORT=7000']}
+
+
+class CodecTest(unittest.TestCase):
+    def test_json_is_passed_through(self):
+        message = {'instance': INSTANCE}
+        self.assertIs(Codec('json').encode(message), message)
+        self.assertIs(Codec('json+zlib').encode(message), message)
+
+    def test_compressed_json(self):
+        message = {'instances': [INSTANCE] * 100}
+        encoded = Codec('json+zlib', compress_min_size=100).encode(message)
+        self.assertEqual(encoded['compression'], 'zlib')
+        self.assertEqual(decode(encoded), message)
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        message = {'instance': INSTANCE}
+        encoded = Codec('msgpack+zlib').encode(message)
+        self.assertEqual(encoded['codec'], 'msgpack')
+        self.assertIsNone(encoded['compression'])
+        self.assertEqual(decode(encoded), message)
+
+    def test_codec_per_queue(self):
+        config = {'message_codec': 'json+zlib',
+                  'message_codec_info': 'json'}
+        self.assertEqual(get_codec(config, 'info').compression, '')
+        self.assertEqual(get_codec(config, 'other').compression, 'zlib')
+        self.assertRaises(ValueError, Codec, 'xml')
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import docker.errors
+import requests
+import requests.exceptions
+from mock import Mock, patch
+
+from workers.docker_client import CircuitBreaker, DockerClient, \
+    DockerUnavailable
+
+
+def make_api_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return docker.errors.APIError('error', response)
+
+
+class DockerClientTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = {'docker_url': 'unix://var/run/docker.sock',
+                       'docker_backoff': '0',
+                       'docker_failure_threshold': '3'}
+        self.docker = Mock()
+        self.docker._version = '1.19'
+        with patch('workers.docker_client.AutoVersionClient',
+                   return_value=self.docker):
+            self.client = DockerClient(self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_retries_idempotent_calls(self):
+        self.docker.containers.side_effect = [
+            requests.exceptions.ConnectionError(), make_api_error(503), []]
+        self.assertEqual(self.client.containers(all=True), [])
+        self.assertEqual(self.docker.containers.call_count, 3)
+
+    def test_does_not_retry_other_calls(self):
+        self.docker.start.side_effect = requests.exceptions.ConnectionError()
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          self.client.start, 'c1')
+        self.assertEqual(self.docker.start.call_count, 1)
+
+    def test_client_errors_are_not_failures(self):
+        self.docker.inspect_container.side_effect = make_api_error(404)
+        for unused in range(5):
+            self.assertRaises(docker.errors.APIError,
+                              self.client.inspect_container, 'c1')
+        self.assertEqual(self.docker.inspect_container.call_count, 5)
+        self.assertFalse(self.client.breaker.open)
+
+    def test_server_errors_are_not_failures(self):
+        self.docker.containers.side_effect = make_api_error(500)
+        for unused in range(5):
+            self.assertRaises(docker.errors.APIError, self.client.containers)
+        self.assertEqual(self.docker.containers.call_count, 5)
+        self.assertFalse(self.client.breaker.open)
+
+    def test_breaker_opens(self):
+        self.docker.containers.side_effect = \
+            requests.exceptions.ConnectionError()
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          self.client.containers)
+        self.assertTrue(self.client.breaker.open)
+        self.assertRaises(DockerUnavailable, self.client.containers)
+        self.assertEqual(self.docker.containers.call_count, 3)
+
+    def test_cached_version(self):
+        cache = os.path.join(self.directory, 'version')
+        self.config['docker_api_version_cache'] = cache
+        with patch('workers.docker_client.AutoVersionClient',
+                   return_value=self.docker) as negotiate:
+            DockerClient(self.config)
+            DockerClient(self.config)
+        self.assertEqual(negotiate.call_count, 1)
+        with open(cache) as cache_file:
+            self.assertEqual(cache_file.read(), '1.19')
+
+    def test_pool_size(self):
+        self.config['docker_api_version'] = '1.19'
+        client = DockerClient(self.config, pool_size=6)
+        adapter = client._client.get_adapter('http+docker://localunixsocket')
+        pool = adapter.get_connection('http+docker://localunixsocket/v')
+        self.assertEqual(pool.pool.maxsize, 6)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_half_open(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=0)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertIsNotNone(breaker.opened)
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertIsNotNone(breaker.opened)
+        breaker.allow()
+        breaker.success()
+        self.assertEqual(breaker.failures, 0)
@@ -0,0 +1,305 @@
+import threading
+import time
+import unittest
+
+import docker.errors
+import requests
+from mock import MagicMock, Mock, patch
+
+from metahosting.common import config_manager
+from tests.fakes import FIRST_PORT, FakeStore, build_worker
+from workers.docker_worker import DockerWorker, _get_pool_size
+from workers.manager.persistence import INSTANCE_STATUS
+
+IMAGE = {u'ContainerConfig': {u'ExposedPorts': {u'8080/tcp': {}}}}
+CONTAINER = {'Id': 'c1',
+             'State': {'Running': True},
+             'NetworkSettings': {'Ports': {u'8080/tcp': [
+                 {u'HostIp': u'0.0.0.0', u'HostPort': u'7000'}]}}}
+
+
+class DockerWorkerTest(unittest.TestCase):
+    def setUp(self):
+        config = self.config = dict()
+        config['persistence'] = config_manager.get_configuration('persistence')
+        config['messaging'] = config_manager.get_configuration('messaging')
+        config['worker'] = config_manager.get_configuration('worker')
+        config['worker']['image'] = 'foo:latest'
+        config['worker']['docker_events'] = 'True'
+        config['instance'] = \
+            config_manager.get_instance_configuration('instance_environment')
+        self.docker = Mock()
+        self.docker.inspect_image.return_value = IMAGE
+        self.docker.containers.return_value = []
+        with patch('workers.docker_client.AutoVersionClient',
+                   return_value=self.docker):
+            self.worker = DockerWorker(config=config,
+                                       persistence=FakeStore,
+                                       messaging=Mock())
+        self.worker.local_persistence = MagicMock()
+
+    def test_start_event_sets_running(self):
+        instance = {'id': '1', 'container_id': 'c1',
+                    'status': INSTANCE_STATUS.STARTING}
+        self.worker._containers['c1'] = '1'
+        self.worker.local_persistence.get_instance.return_value = instance
+        self.docker.inspect_container.return_value = CONTAINER
+        self.worker._handle_container_event({'status': 'start', 'id': 'c1'})
+        self.worker.local_persistence.update_instance_status.\
+            assert_called_with(instance, INSTANCE_STATUS.RUNNING)
+        self.assertEqual(instance['urls'], ['http://192.168.1.1:7000'])
+
+    def test_die_event_sets_stopped(self):
+        instance = {'id': '1', 'container_id': 'c1', 'urls': [],
+                    'status': INSTANCE_STATUS.RUNNING}
+        self.worker._containers['c1'] = '1'
+        self.worker.local_persistence.get_instance.return_value = instance
+        self.worker._handle_container_event({'status': 'die', 'id': 'c1'})
+        self.worker.local_persistence.update_instance_status.\
+            assert_called_with(instance, INSTANCE_STATUS.STOPPED)
+        self.assertNotIn('urls', instance)
+
+    def test_kill_event_keeps_running_container(self):
+        instance = {'id': '1', 'container_id': 'c1',
+                    'status': INSTANCE_STATUS.RUNNING}
+        self.worker._containers['c1'] = '1'
+        self.worker.local_persistence.get_instance.return_value = instance
+        self.docker.inspect_container.return_value = CONTAINER
+        self.worker._handle_container_event({'status': 'kill', 'id': 'c1'})
+        self.assertFalse(
+            self.worker.local_persistence.update_instance_status.called)
+        self.docker.inspect_container.return_value = {
+            'Id': 'c1', 'State': {'Running': False}}
+        self.worker._handle_container_event({'status': 'kill', 'id': 'c1'})
+        self.worker.local_persistence.update_instance_status.\
+            assert_called_with(instance, INSTANCE_STATUS.STOPPED)
+
+    def test_event_for_deleted_instance_is_ignored(self):
+        instance = {'id': '1', 'container_id': 'c1',
+                    'status': INSTANCE_STATUS.DELETED}
+        self.worker._containers['c1'] = '1'
+        self.worker.local_persistence.get_instance.return_value = instance
+        self.worker._handle_container_event({'status': 'die', 'id': 'c1'})
+        self.assertFalse(
+            self.worker.local_persistence.update_instance_status.called)
+
+    def test_event_for_unknown_container_is_ignored(self):
+        self.worker._handle_container_event({'status': 'die', 'id': 'c2'})
+        self.assertFalse(self.worker.local_persistence.get_instance.called)
+
+    def test_publish_updates_uses_container_listing(self):
+        instance = {'id': '1', 'container_id': 'c1',
+                    'status': INSTANCE_STATUS.STARTING}
+        self.worker.local_persistence.get_instance_ids.side_effect = \
+            lambda *statuses: ['1'] if INSTANCE_STATUS.STARTING in statuses \
+            else []
+        self.worker.local_persistence.get_instance.return_value = instance
+        self.docker.containers.return_value = [
+            {'Id': 'c1', 'Status': 'Up 2 minutes',
+             'Ports': [{'IP': '0.0.0.0', 'PrivatePort': 8080,
+                        'PublicPort': 7000, 'Type': 'tcp'}]}]
+        self.worker._publish_updates()
+        self.assertFalse(self.docker.inspect_container.called)
+        self.worker.local_persistence.update_instance_status.\
+            assert_called_with(instance, INSTANCE_STATUS.RUNNING)
+        self.assertEqual(instance['urls'], ['http://192.168.1.1:7000'])
+        self.assertIn(7000, self.worker.port_manager.used_ports)
+
+    def test_create_instance_from_warm_pool(self):
+        self.docker.create_container.return_value = {'Id': 'c1'}
+        self.docker.inspect_container.return_value = CONTAINER
+        self.worker._warm_pool = Mock()
+        self.worker._warm_pool.get.return_value = {
+            'container': {'Id': 'c1'},
+            'ports': [7000],
+            'environment': []}
+        self.worker.create_instance({'id': '1'})
+        self.assertFalse(self.docker.create_container.called)
+        self.docker.start.assert_called_with({'Id': 'c1'},
+                                             port_bindings={'8080': 7000})
+
+    def test_create_rejected_without_ports(self):
+        self.worker.port_manager.update_used_ports(
+            self.worker.port_manager.acquire_ports(
+                self.worker.port_manager.free_count))
+        self.worker.create({'id': '1'})
+        self.assertFalse(self.docker.create_container.called)
+        self.worker.local_persistence.update_instance_status.\
+            assert_called_with(instance={'id': '1'},
+                               status=INSTANCE_STATUS.FAILED)
+        self.assertFalse(self.worker.worker['available'])
+
+    def test_present_image_is_pulled_in_background(self):
+        self.assertFalse(self.docker.import_image.called)
+        self.assertTrue(self.worker._pull_in_background)
+        self.assertEqual(self.worker._image_ports, ['8080'])
+        self.worker._refresh_image()
+        self.assertTrue(self.docker.import_image.called)
+
+    def test_missing_image_is_pulled(self):
+        response = requests.Response()
+        response.status_code = 404
+        self.docker.inspect_image.side_effect = [
+            docker.errors.APIError('missing', response), IMAGE]
+        self.worker._initialize_image()
+        self.docker.import_image.assert_called_with(image='foo', tag='latest')
+        self.assertFalse(self.worker._pull_in_background)
+
+    def test_present_image_is_kept(self):
+        self.config['worker']['image_pull'] = 'missing'
+        self.worker._initialize_image()
+        self.assertFalse(self.docker.import_image.called)
+        self.assertFalse(self.worker._pull_in_background)
+
+    def test_delete_instances(self):
+        instances = dict(
+            (instance_id, {'id': instance_id,
+                           'container_id': 'c' + instance_id,
+                           'status': INSTANCE_STATUS.RUNNING})
+            for instance_id in ('1', '2'))
+        self.worker.local_persistence.get_instance.side_effect = \
+            lambda instance_id: instances[instance_id]
+        self.docker.containers.return_value = [
+            {'Id': 'c1', 'Status': 'Up 2 minutes',
+             'Ports': [{'IP': '0.0.0.0', 'PrivatePort': 8080,
+                        'PublicPort': 7000, 'Type': 'tcp'}]},
+            {'Id': 'c2', 'Status': 'Up 2 minutes',
+             'Ports': [{'IP': '0.0.0.0', 'PrivatePort': 8080,
+                        'PublicPort': 7001, 'Type': 'tcp'}]}]
+        self.worker.port_manager.update_used_ports([7000, 7001])
+        free_count = self.worker.port_manager.free_count
+        self.docker.containers.reset_mock()
+        self.worker.delete_instances([{'id': '1'}, {'id': '2'}])
+        self.assertEqual(self.docker.containers.call_count, 1)
+        self.assertFalse(self.docker.inspect_container.called)
+        self.assertEqual(self.docker.remove_container.call_count, 2)
+        self.assertEqual(self.worker.port_manager.free_count, free_count + 2)
+        self.worker.local_persistence.update_instance_status.\
+            assert_any_call(instance=instances['1'],
+                            status=INSTANCE_STATUS.DELETED)
+
+    def test_no_capacity_without_headroom(self):
+        self.assertGreater(self.worker._capacity(), 0)
+        self.worker._sampler = Mock()
+        self.worker._sampler.has_headroom.return_value = False
+        self.worker._sampler.score.return_value = 0.05
+        self.worker._update_worker_status()
+        self.assertEqual(self.worker._capacity(), 0)
+        self.assertFalse(self.worker.worker['available'])
+        self.assertEqual(self.worker.worker['capacity']['score'], 0.05)
+
+    def test_running_container_waits_for_probe(self):
+        instance = {'id': '1', 'container_id': 'c1',
+                    'status': INSTANCE_STATUS.STARTING}
+        self.worker._prober = Mock()
+        self.worker._prober.is_probing.return_value = False
+        self.worker._probe_host = '127.0.0.1'
+        self.worker.local_persistence.get_instance.return_value = instance
+        self.worker._set_running(instance, CONTAINER['NetworkSettings'][
+            'Ports'])
+        self.worker.local_persistence.update_instance_status.\
+            assert_called_with(instance, INSTANCE_STATUS.STARTING)
+        self.worker._prober.probe.assert_called_with(
+            '1', [('127.0.0.1', 7000)], self.worker._probe_finished)
+        self.worker._probe_finished('1', True)
+        self.worker.local_persistence.update_instance_status.\
+            assert_called_with(instance, INSTANCE_STATUS.RUNNING)
+
+
+class DockerWorkerAdmissionTest(unittest.TestCase):
+    def setUp(self):
+        self.worker, self.docker = build_worker(
+            'docker', 1, {'ports': '{}:{}'.format(FIRST_PORT, FIRST_PORT + 1),
+                          'dispatch_threads': '2'})
+
+    def tearDown(self):
+        self.worker._pool.shutdown()
+
+    def test_overlapping_creates(self):
+        entered = threading.Event()
+        proceed = threading.Event()
+        create_container = self.docker.create_container
+
+        def slow_create_container(*args, **kwargs):
+            if not entered.is_set():
+                entered.set()
+                proceed.wait(5)
+            return create_container(*args, **kwargs)
+        self.docker.create_container = slow_create_container
+
+        self.worker._dispatch({'subject': 'create_instance', 'id': 'a'})
+        self.assertTrue(entered.wait(5))
+        self.assertEqual(self.worker.admission.free_slots(), 1)
+        self.assertTrue(self.worker.worker['available'])
+        self.worker.create({'id': 'b'})
+        proceed.set()
+        self.worker._pool.join()
+        for instance_id in ('a', 'b'):
+            self.assertEqual(
+                self.worker.local_persistence.get_instance(
+                    instance_id)['status'], INSTANCE_STATUS.STARTING)
+        self.assertEqual(self.worker.port_manager.free_count, 0)
+
+    def test_batch_waits_for_in_flight_slots(self):
+        worker, client = build_worker(
+            'docker', 16, {'max_inflight_creates': '2', 'batch_threads': '8'})
+        create_container = client.create_container
+
+        def slow_create_container(*args, **kwargs):
+            time.sleep(0.01)
+            return create_container(*args, **kwargs)
+        client.create_container = slow_create_container
+        ids = [str(number) for number in range(16)]
+        worker.create_batch({'ids': ids})
+        self.assertEqual(
+            [worker.local_persistence.get_instance(instance_id)['status']
+             for instance_id in ids], [INSTANCE_STATUS.STARTING] * 16)
+        self.assertEqual(worker.admission.in_flight, 0)
+
+
+class FakeDockerWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.worker, self.docker = build_worker('docker', 1, {})
+
+    def test_pool_covers_all_docker_threads(self):
+        worker_conf = {'dispatch_threads': '4'}
+        self.assertEqual(_get_pool_size(worker_conf, 8), 16)
+        worker_conf.update({'resource_sampling': 'True',
+                            'sampler_threads': '2'})
+        self.assertEqual(_get_pool_size(worker_conf, 8), 18)
+
+    def test_stop_drains_warm_pool(self):
+        worker, client = build_worker('docker', 2, {'warm_pool_size': '2'})
+        worker._warm_pool.refill()
+        self.assertEqual(len(client.containers_by_id), 2)
+        worker.stop(None, None)
+        self.assertEqual(client.containers_by_id, {})
+        self.assertEqual(worker.port_manager.used_ports, set())
+
+    def test_only_primary_follows_events(self):
+        worker, unused = build_worker(
+            'docker', 1, {'docker_events': 'True', 'process_index': '1'})
+        with patch('workers.docker_worker.threading.Thread') as thread:
+            worker._start_background()
+        self.assertNotIn('docker-events', [
+            call[1].get('name') for call in thread.call_args_list])
+
+    def test_delete_with_missing_container(self):
+        self.worker.create_instance({'id': '1'})
+        instance = self.worker.local_persistence.get_instance('1')
+        self.docker.remove_container(instance['container_id'])
+        self.worker.delete_instance({'id': '1'})
+        self.assertEqual(
+            self.worker.local_persistence.get_instance('1')['status'],
+            INSTANCE_STATUS.DELETED)
+        self.assertEqual(self.worker.port_manager.used_ports, set())
+
+    def test_batch_delete_with_missing_container(self):
+        self.worker.create_instance({'id': '1'})
+        instance = self.worker.local_persistence.get_instance('1')
+        self.docker.remove_container(instance['container_id'])
+        self.worker.delete_batch({'ids': ['1']})
+        self.assertEqual(
+            self.worker.local_persistence.get_instance('1')['status'],
+            INSTANCE_STATUS.DELETED)
+        self.assertEqual(self.worker.port_manager.used_ports, set())
@@ -3,6 +3,7 @@ import unittest
 from mock import Mock
 
 from metahosting.common import config_manager
+from tests.fakes import FakeStore
 from workers.dummy_worker import DummyWorker
 from workers.manager.persistence import INSTANCE_STATUS
 from workers.manager.persistence import PersistenceManager
@@ -10,7 +11,7 @@ from workers.manager.persistence import PersistenceManager
 
 class DummyWorkerTest(unittest.TestCase):
     def setUp(self):
-        self.instance_manager = Mock()
+        self.instance_manager = FakeStore
         self.messaging = Mock()
         config = dict()
         config['persistence'] = config_manager.get_configuration('persistence')
@@ -21,9 +22,14 @@ class DummyWorkerTest(unittest.TestCase):
         self.worker = DummyWorker(config=config,
                                   persistence=self.instance_manager,
                                   messaging=self.messaging)
+        self._get_instance = PersistenceManager.get_instance
+        self._update_instance_status = \
+            PersistenceManager.update_instance_status
 
     def tearDown(self):
-        pass
+        PersistenceManager.get_instance = self._get_instance
+        PersistenceManager.update_instance_status = \
+            self._update_instance_status
 
     def test_create_instance(self):
         instance = {'id': '1121', 'foo': 'bar'}
@@ -35,6 +41,7 @@ class DummyWorkerTest(unittest.TestCase):
 
     def test_delete_instance(self):
         message = {'id': '71'}
+        PersistenceManager.update_instance_status = Mock()
         PersistenceManager.get_instance = Mock(return_value=None)
         self.worker.delete_instance(message)
         PersistenceManager.get_instance.assert_called_with('71')
@@ -45,3 +52,27 @@ class DummyWorkerTest(unittest.TestCase):
         PersistenceManager.get_instance.assert_called_with('71')
         PersistenceManager.update_instance_status.assert_called_with(
             instance, INSTANCE_STATUS.DELETED)
+
+    def test_delete_instances(self):
+        for instance_id in ('1', '2', '3'):
+            self.worker.local_persistence.set_instance(
+                instance_id,
+                {'id': instance_id, 'status': INSTANCE_STATUS.RUNNING})
+        self.worker.batch_threads = 2
+        self.worker.delete_batch({'ids': ['1', '2', '3']})
+        for instance_id in ('1', '2', '3'):
+            self.assertEqual(
+                self.worker.local_persistence.get_instance(
+                    instance_id)['status'], INSTANCE_STATUS.DELETED)
+        publish = self.worker.publish_manager.publish
+        self.assertEqual(publish.call_count, 1)
+        queue, subject, message = publish.call_args[0]
+        self.assertEqual(subject, 'instance_info_batch')
+        self.assertEqual(len(message['instances']), 3)
+
+    def test_create_after_delete_is_dropped(self):
+        self.worker.delete_instance({'id': '7'})
+        self.worker.create({'id': '7'})
+        self.assertEqual(
+            self.worker.local_persistence.get_instance('7')['status'],
+            INSTANCE_STATUS.DELETED)
@@ -0,0 +1,33 @@
+import unittest
+
+from workers.environment import ALPHABET, EnvironmentTemplate, \
+    get_random_keys
+
+
+class EnvironmentTemplateTest(unittest.TestCase):
+    def test_render(self):
+        template = EnvironmentTemplate({'USER': 'admin',
+                                        'PASSWORD': '',
+                                        'PORT': 'INJECT_PORT'})
+        environment = dict(item.split('=', 1)
+                           for item in template.render([7000]))
+        self.assertEqual(environment['USER'], 'admin')
+        self.assertEqual(environment['PORT'], '7000')
+        self.assertEqual(len(environment['PASSWORD']), 16)
+        self.assertNotEqual(template.render([7000]), template.render([7000]))
+
+    def test_port_injection_order(self):
+        template = EnvironmentTemplate({'A': 'INJECT_PORT'})
+        self.assertEqual(template.render(), ['A=INJECT_PORT'])
+        template._entries = [('A=', ['', ''], 0), ('B=', ['x:', ''], 1),
+                             ('C=', ['', ''], 2)]
+        self.assertEqual(template.render([1, 2]), ['A=1', 'B=x:2', 'C=1'])
+
+    def test_random_keys(self):
+        keys = get_random_keys(50, length=20)
+        self.assertEqual(len(keys), 50)
+        self.assertEqual(len(set(keys)), 50)
+        for key in keys:
+            self.assertEqual(len(key), 20)
+            self.assertTrue(set(key) <= set(ALPHABET))
+        self.assertEqual(get_random_keys(0), [])
@@ -0,0 +1,146 @@
+import unittest
+
+import docker.errors
+from mock import patch
+
+from tests.fakes import FIRST_PORT, FakeDockerClient, FakeMessaging, \
+    FakeStore, build_worker, get_config
+from workers.docker_worker import POOL_LABEL, PORTS_LABEL, DockerWorker
+from workers.manager.lease import LeaseChecker, get_lease
+from workers.manager.persistence import INSTANCE_STATUS
+
+
+class LeaseCheckerTest(unittest.TestCase):
+    def setUp(self):
+        self.checker = LeaseChecker(grace=60)
+        self.leases = {'1': get_lease([7000, 7001], 'c1')}
+
+    def test_held_ports_are_kept(self):
+        leaked, conflicts = self.checker.diff(
+            set([7000, 7001, 7002]), self.leases, {7002: 'c2'}, now=100)
+        self.assertEqual(leaked, [])
+        self.assertEqual(conflicts, [])
+
+    def test_leak_after_grace(self):
+        used = set([7000, 7001, 7005])
+        self.assertEqual(
+            self.checker.diff(used, self.leases, {}, now=100)[0], [])
+        self.assertEqual(
+            self.checker.diff(used, self.leases, {}, now=159)[0], [])
+        self.assertEqual(
+            self.checker.diff(used, self.leases, {}, now=160)[0], [7005])
+
+    def test_accounted_port_restarts_grace(self):
+        used = set([7005])
+        self.checker.diff(used, {}, {}, now=100)
+        self.checker.diff(used, {}, {7005: 'c2'}, now=130)
+        self.assertEqual(self.checker.diff(used, {}, {}, now=170)[0], [])
+        self.assertEqual(self.checker.diff(used, {}, {}, now=230)[0], [7005])
+
+    def test_double_lease_conflict(self):
+        self.leases['2'] = get_lease([7001], 'c2')
+        unused, conflicts = self.checker.diff(
+            set([7000, 7001]), self.leases, {}, now=100)
+        self.assertEqual(conflicts, [{'port': 7001, 'owners': ['1', '2']}])
+
+    def test_foreign_container_conflict(self):
+        unused, conflicts = self.checker.diff(
+            set([7000, 7001]), self.leases, {7000: 'c1', 7001: 'c9'},
+            now=100)
+        self.assertEqual(conflicts, [{'port': 7001, 'owners': ['1', 'c9']}])
+
+
+class DockerWorkerLeaseTest(unittest.TestCase):
+    def setUp(self):
+        self.worker, self.docker = build_worker(
+            'docker', 10, {'port_lease_grace': '0'})
+
+    def test_create_stores_lease(self):
+        self.worker.create_instance({'id': '1'})
+        instance = self.worker.local_persistence.get_instance('1')
+        self.assertEqual(instance['lease']['ports'], [FIRST_PORT])
+        self.assertEqual(instance['lease']['container_id'],
+                         instance['container_id'])
+        labels = self.docker.containers_by_id[
+            instance['container_id']]['Labels']
+        self.assertEqual(labels[PORTS_LABEL], str(FIRST_PORT))
+
+    def test_startup_loads_leases_and_lists_once(self):
+        worker, client = self._start_with({
+            '1': {'id': '1', 'container_id': 'c1',
+                  'status': INSTANCE_STATUS.STOPPED,
+                  'lease': get_lease([FIRST_PORT + 3], 'c1')},
+            '2': {'id': '2', 'container_id': 'c2',
+                  'status': INSTANCE_STATUS.DELETED,
+                  'lease': get_lease([FIRST_PORT + 4], 'c2')}})
+        self.assertEqual(worker.port_manager.used_ports,
+                         set([FIRST_PORT + 3, FIRST_PORT + 6]))
+        self.assertEqual(client.calls['containers'], 1)
+
+    def test_leaked_port_is_reclaimed(self):
+        self.worker.create_instance({'id': '1'})
+        self.worker.port_manager.update_used_ports([FIRST_PORT + 5])
+        self.worker._resync_ports()
+        self.assertEqual(self.worker.port_manager.used_ports,
+                         set([FIRST_PORT]))
+
+    def test_pool_container_ports_are_kept(self):
+        self.worker.port_manager.update_used_ports([FIRST_PORT + 5])
+        self.docker.add_container(
+            running=False,
+            labels={POOL_LABEL: 'bench', PORTS_LABEL: str(FIRST_PORT + 5)})
+        self.worker._resync_ports()
+        self.assertIn(FIRST_PORT + 5, self.worker.port_manager.used_ports)
+
+    def test_leftover_pool_container_ports_are_released(self):
+        client = FakeDockerClient()
+        client.add_container(
+            running=False,
+            labels={POOL_LABEL: 'bench', PORTS_LABEL: str(FIRST_PORT + 5)})
+        with patch('workers.docker_client.AutoVersionClient',
+                   return_value=client):
+            worker = DockerWorker(
+                config=get_config(10, {'warm_pool_size': '1'}),
+                persistence=FakeStore,
+                messaging=FakeMessaging)
+        self.assertEqual(client.containers_by_id, {})
+        self.assertEqual(worker.port_manager.used_ports, set())
+
+    def test_delete_stopped_instance_releases_lease(self):
+        self.worker.create_instance({'id': '1'})
+        instance = self.worker.local_persistence.get_instance('1')
+        self.worker.local_persistence.update_instance_status(
+            instance, INSTANCE_STATUS.STOPPED)
+        self.worker.delete_instance({'id': '1'})
+        self.assertEqual(self.worker.port_manager.used_ports, set())
+        self.worker.delete_instance({'id': '1'})
+        self.assertEqual(self.worker.port_manager.free_count,
+                         self.worker.port_manager.size)
+
+    def test_failed_start_releases_ports(self):
+        def start(container, **kwargs):
+            raise docker.errors.DockerException('start failed')
+        self.docker.start = start
+        self.worker.create_instance({'id': '1'})
+        self.assertEqual(
+            self.worker.local_persistence.get_instance('1')['status'],
+            INSTANCE_STATUS.FAILED)
+        self.assertEqual(self.docker.containers_by_id, {})
+        self.worker._resync_ports()
+        self.worker._resync_ports()
+        self.assertEqual(self.worker.port_manager.used_ports, set())
+
+    def _start_with(self, instances):
+        class StoredInstances(FakeStore):
+            def __init__(self, config=None):
+                FakeStore.__init__(self, config)
+                self.data.update(instances)
+        client = FakeDockerClient()
+        # a container the worker did not start
+        client.add_container(ports=[FIRST_PORT + 6])
+        with patch('workers.docker_client.AutoVersionClient',
+                   return_value=client):
+            worker = DockerWorker(config=get_config(10, {}),
+                                  persistence=StoredInstances,
+                                  messaging=FakeMessaging)
+        return worker, client
@@ -0,0 +1,34 @@
+import json
+import unittest
+
+from workers.metrics import Registry
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('calls_total', 'Calls')
+        counter.inc()
+        counter.inc(2)
+        self.assertIs(self.registry.counter('calls_total', 'Calls'), counter)
+        self.assertIn('calls_total 3', self.registry.render())
+        self.assertEqual(self.registry.summary(), {'calls_total': 3})
+
+    def test_gauge_function(self):
+        self.registry.gauge('free', 'Free').set_function(lambda: 7)
+        self.assertIn('# TYPE free gauge\nfree 7', self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('seconds', 'Time', (0.1, 1))
+        histogram.observe(0.05, subject='a')
+        histogram.observe(0.5, subject='a')
+        text = self.registry.render()
+        self.assertIn('seconds_bucket{subject="a",le="0.1"} 1', text)
+        self.assertIn('seconds_bucket{subject="a",le="1"} 2', text)
+        self.assertIn('seconds_bucket{subject="a",le="+Inf"} 2', text)
+        self.assertIn('seconds_count{subject="a"} 2', text)
+        summary = self.registry.summary()
+        self.assertEqual(summary['seconds']['subject=a']['count'], 2)
+        json.dumps(summary)
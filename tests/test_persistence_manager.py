@@ -1,30 +1,139 @@
+from mock import Mock
+
+from tests.fakes import FakeStore
+from workers.manager.persistence import INSTANCE_STATUS
 from workers.manager.persistence import PersistenceManager
 from unittest import TestCase
 
 
 class TestLocalInstanceManager(TestCase):
     def setUp(self):
+        self.publish = Mock()
         self.persistence = PersistenceManager(
-            config={'backend': 'stores.dict_store.Store'},
-            send_method=self.foo())
+            config={'snapshot_interval': '300'},
+            backend=FakeStore,
+            publish=self.publish)
+        self.store = self.persistence.instances
 
     def tearDown(self):
         pass
 
-    def foo(self):
-        pass
-    #
-    # def test_get_instance(self):
-    #     self.fail()
-    #
-    # def test_get_instances(self):
-    #     self.fail()
-    #
-    # def test_set_instance(self):
-    #     self.fail()
-    #
-    # def test_update_instance_status(self):
-    #     self.fail()
-    #
-    # def test_publish_instance(self):
-    #     self.fail()
+    def test_update_instance_status(self):
+        instance = {'id': '1'}
+        self.persistence.update_instance_status(
+            instance, INSTANCE_STATUS.STARTING)
+        self.assertEqual(self.persistence.get_instance('1')['status'],
+                         INSTANCE_STATUS.STARTING)
+        self.publish.assert_called_with(
+            'info', 'instance_info', {'instance': instance})
+
+    def test_unchanged_instance_is_skipped(self):
+        instance = {'id': '1'}
+        self.persistence.update_instance_status(
+            instance, INSTANCE_STATUS.RUNNING)
+        self.persistence.update_instance_status(
+            dict(instance), INSTANCE_STATUS.RUNNING)
+        self.assertEqual(self.store.calls['update'], 1)
+        self.assertEqual(self.publish.call_count, 1)
+        self.persistence.update_instance_status(
+            dict(instance), INSTANCE_STATUS.STOPPED)
+        self.assertEqual(self.store.calls['update'], 2)
+        self.assertEqual(self.publish.call_count, 2)
+
+    def test_batch_coalesces_changes(self):
+        with self.persistence.batch():
+            for instance_id in ('1', '2'):
+                self.persistence.update_instance_status(
+                    {'id': instance_id}, INSTANCE_STATUS.STARTING)
+        self.assertEqual(self.publish.call_count, 1)
+        queue, subject, message = self.publish.call_args[0]
+        self.assertEqual(subject, 'instance_info_batch')
+        self.assertEqual(len(message['instances']), 2)
+
+    def test_batch_snapshot(self):
+        self.persistence.update_instance_status(
+            {'id': '1'}, INSTANCE_STATUS.RUNNING)
+        self.persistence.update_instance_status(
+            {'id': '2'}, INSTANCE_STATUS.DELETED)
+        with self.persistence.batch():
+            pass
+        message = self.publish.call_args[0][2]
+        self.assertTrue(message['snapshot'])
+        self.assertEqual([i['id'] for i in message['instances']], ['1'])
+        self.publish.reset_mock()
+        with self.persistence.batch():
+            pass
+        self.assertFalse(self.publish.called)
+
+    def test_reads_are_served_from_cache(self):
+        self.persistence.update_instance_status(
+            {'id': '1'}, INSTANCE_STATUS.RUNNING)
+        self.persistence.get_instance('1')['status'] = 'changed'
+        self.assertEqual(self.persistence.get_instance('1')['status'],
+                         INSTANCE_STATUS.RUNNING)
+        self.assertEqual(len(self.persistence.get_instances()), 1)
+        self.assertEqual(self.store.calls['get'], 0)
+        self.assertEqual(self.store.calls['get_all'], 1)
+
+    def test_write_behind(self):
+        persistence = PersistenceManager(
+            config={'write_behind': 'True'},
+            backend=FakeStore,
+            publish=self.publish)
+        with persistence.batch():
+            persistence.update_instance_status(
+                {'id': '1'}, INSTANCE_STATUS.RUNNING)
+            persistence.update_instance_status(
+                {'id': '1', 'urls': []}, INSTANCE_STATUS.RUNNING)
+            self.assertEqual(persistence.instances.calls['update'], 0)
+        self.assertEqual(persistence.instances.calls['update'], 1)
+        self.assertEqual(persistence.instances.data['1']['urls'], [])
+
+    def test_compact(self):
+        store = FakeStore()
+        archive = FakeStore()
+        stores = [store, archive]
+        persistence = PersistenceManager(
+            config={'retention_ttl': '60', 'archive_collection': 'archive'},
+            backend=lambda config: stores.pop(0),
+            publish=self.publish)
+        for instance_id, status in (('1', INSTANCE_STATUS.RUNNING),
+                                    ('2', INSTANCE_STATUS.DELETED),
+                                    ('3', INSTANCE_STATUS.FAILED)):
+            persistence.update_instance_status({'id': instance_id}, status)
+        store.data['2']['ts'] -= 120
+        persistence._cache['2']['ts'] -= 120
+        self.assertEqual(persistence.compact(), 1)
+        self.assertIsNone(persistence.get_instance('2'))
+        self.assertIsNotNone(persistence.get_instance('3'))
+        self.assertEqual(list(archive.data.keys()), ['2'])
+
+    def test_failed_republish_limit(self):
+        self.persistence.failed_republish_limit = 2
+        self.persistence.update_instance_status(
+            {'id': '1'}, INSTANCE_STATUS.FAILED)
+        for unused in range(5):
+            self.persistence.republish_failed('1')
+        self.assertEqual(self.publish.call_count, 3)
+
+    def test_status_index(self):
+        for instance_id, status in (('1', INSTANCE_STATUS.RUNNING),
+                                    ('2', INSTANCE_STATUS.DELETED),
+                                    ('3', INSTANCE_STATUS.STARTING)):
+            self.persistence.update_instance_status({'id': instance_id},
+                                                    status)
+        self.persistence.update_instance_status(
+            {'id': '3'}, INSTANCE_STATUS.RUNNING)
+        self.assertEqual(
+            sorted(self.persistence.get_instance_ids(
+                INSTANCE_STATUS.STARTING, INSTANCE_STATUS.RUNNING)),
+            ['1', '3'])
+        self.assertEqual(
+            list(self.persistence.get_instances_by_status(
+                INSTANCE_STATUS.DELETED).keys()), ['2'])
+        persistence = PersistenceManager(config={'cache': 'False'},
+                                         backend=FakeStore,
+                                         publish=self.publish)
+        persistence.instances.data = dict(self.store.data)
+        self.assertEqual(
+            persistence.get_instance_ids(INSTANCE_STATUS.DELETED), ['2'])
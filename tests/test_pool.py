@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from workers.pool import DispatchPool, KeyedLock, SharedKeyedLock
+
+
+class DispatchPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = DispatchPool(4)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_submit(self):
+        done = threading.Event()
+        self.pool.submit(done.set)
+        self.assertTrue(done.wait(1))
+
+    def test_error_does_not_stop_thread(self):
+        pool = DispatchPool(1)
+        done = threading.Event()
+        pool.submit(lambda: 1 / 0)
+        pool.submit(done.set)
+        self.assertTrue(done.wait(1))
+        pool.shutdown()
+
+    def test_calls_run_concurrently(self):
+        barrier = threading.Semaphore(0)
+        done = threading.Event()
+
+        def wait_for_other():
+            barrier.release()
+            time.sleep(0.05)
+            barrier.acquire()
+            done.set()
+
+        self.pool.submit(wait_for_other)
+        self.pool.submit(wait_for_other)
+        self.assertTrue(done.wait(1))
+
+
+class KeyedLockTest(unittest.TestCase):
+    def setUp(self):
+        self.lock = KeyedLock()
+
+    def test_same_key_is_serialized(self):
+        events = list()
+
+        def hold(name):
+            with self.lock('1'):
+                events.append(name + ' in')
+                time.sleep(0.02)
+                events.append(name + ' out')
+
+        threads = [threading.Thread(target=hold, args=(name,))
+                   for name in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        first, second = events[0].split()[0], events[2].split()[0]
+        self.assertEqual(set([first, second]), set(['a', 'b']))
+        self.assertEqual(events, [first + ' in', first + ' out',
+                                  second + ' in', second + ' out'])
+
+    def test_reentrant_and_released(self):
+        with self.lock('1'):
+            with self.lock('1'):
+                pass
+        self.assertEqual(self.lock._locks, {})
+
+
+class SharedKeyedLockTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'instances.locks')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_other_process_waits(self):
+        read, write = os.pipe()
+        pid = os.fork()
+        if not pid:
+            with SharedKeyedLock(self.path)('1'):
+                os.write(write, b'x')
+                time.sleep(0.3)
+            os._exit(0)
+        os.read(read, 1)
+        started = time.time()
+        with SharedKeyedLock(self.path)('1'):
+            waited = time.time() - started
+        os.waitpid(pid, 0)
+        self.assertGreater(waited, 0.1)
+
+    def test_threads_share_a_stripe(self):
+        lock = SharedKeyedLock(self.path, stripes=1)
+        events = list()
+
+        def hold(key):
+            with lock(key):
+                events.append(key + ' in')
+                time.sleep(0.02)
+                events.append(key + ' out')
+
+        threads = [threading.Thread(target=hold, args=(key,))
+                   for key in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        first, second = events[0][0], events[2][0]
+        self.assertEqual(events, [first + ' in', first + ' out',
+                                  second + ' in', second + ' out'])
+        with lock('a'):
+            with lock('a'):
+                pass
+        self.assertEqual(lock._depths, [0])
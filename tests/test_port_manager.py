@@ -1,5 +1,9 @@
+import os
+import shutil
+import tempfile
+
 from unittest import TestCase
-from workers.manager.port import PortManager
+from workers.manager.port import PortManager, SharedPortManager
 
 
 class TestPortManager(TestCase):
@@ -66,3 +70,49 @@ class TestPortManager(TestCase):
         self.assertTrue(len(self.port_manager.used_ports) == 2)
         self.port_manager.update_used_ports([6, 7])
         self.assertTrue(len(self.port_manager.used_ports) == 4)
+
+    def test_free_count(self):
+        self.assertEqual(self.port_manager.free_count, 5)
+        ports = self.port_manager.acquire_ports(2)
+        self.assertEqual(self.port_manager.free_count, 3)
+        self.port_manager.release_ports(ports)
+        self.port_manager.release_ports(ports)
+        self.assertEqual(self.port_manager.free_count, 5)
+        self.port_manager.update_used_ports([1, 1, 9])
+        self.assertEqual(self.port_manager.free_count, 4)
+
+    def test_acquire_contiguous_block(self):
+        self.assertEqual(self.port_manager.acquire_ports(3), [1, 2, 3])
+        self.assertEqual(self.port_manager.acquire_ports(2), [4, 5])
+
+    def test_acquire_fragmented(self):
+        self.port_manager.update_used_ports([2, 4])
+        ports = self.port_manager.acquire_ports(3)
+        self.assertEqual(sorted(ports), [1, 3, 5])
+        self.assertIsNone(self.port_manager.acquire_ports(1))
+
+
+class TestSharedPortManager(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'ports')
+        self.first = SharedPortManager({'ports': '1:5'}, path)
+        self.second = SharedPortManager({'ports': '1:5'}, path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ports_are_not_handed_out_twice(self):
+        ports = self.first.acquire_ports(2)
+        self.assertEqual(self.second.free_count, 3)
+        self.assertFalse(set(ports) & set(self.second.acquire_ports(3)))
+        self.assertIsNone(self.first.acquire_ports(1))
+        self.second.release_ports(ports)
+        self.assertEqual(self.first.free_count, 2)
+        self.assertEqual(sorted(self.first.acquire_ports(2)), ports)
+
+    def test_reset(self):
+        self.first.update_used_ports([1, 2])
+        self.second.reset()
+        self.assertEqual(self.first.free_count, 5)
+        self.assertEqual(self.first.used_ports, set())
@@ -0,0 +1,117 @@
+import os
+import resource
+import socket
+import threading
+import time
+import unittest
+
+from workers.manager.probe import Prober
+
+
+def listen():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(16)
+    return server
+
+
+def get_free_port():
+    server = listen()
+    port = server.getsockname()[1]
+    server.close()
+    return port
+
+
+class ProberTest(unittest.TestCase):
+    def setUp(self):
+        self.results = dict()
+        self.done = threading.Event()
+        self.running = True
+        self.servers = list()
+
+    def tearDown(self):
+        self.running = False
+        for server in self.servers:
+            server.close()
+
+    def start(self, prober):
+        thread = threading.Thread(target=prober.run,
+                                  args=(lambda: self.running,))
+        thread.daemon = True
+        thread.start()
+
+    def callback(self, key, ready):
+        self.results[key] = ready
+        if len(self.results) == self.expected:
+            self.done.set()
+
+    def test_tcp(self):
+        server = listen()
+        self.servers.append(server)
+        prober = Prober(timeout=0.5, interval=0.05)
+        self.start(prober)
+        self.expected = 2
+        prober.probe('up', [server.getsockname()], self.callback)
+        prober.probe('down', [('127.0.0.1', get_free_port())],
+                     self.callback)
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.results, {'up': True, 'down': False})
+        self.assertEqual(prober.pending, 0)
+
+    def test_descriptors_above_fd_setsize(self):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and hard < 1200:
+            self.skipTest('not enough file descriptors')
+        if soft != resource.RLIM_INFINITY and soft < 1200:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (1200, hard))
+        descriptors = [os.dup(0) for unused in range(1100)]
+        try:
+            server = listen()
+            self.servers.append(server)
+            self.assertGreater(server.fileno(), 1024)
+            prober = Prober(timeout=0.5, interval=0.05)
+            self.start(prober)
+            self.expected = 1
+            prober.probe('up', [server.getsockname()], self.callback)
+            self.assertTrue(self.done.wait(2))
+            self.assertEqual(self.results, {'up': True})
+        finally:
+            for descriptor in descriptors:
+                os.close(descriptor)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    def test_service_coming_up(self):
+        port = get_free_port()
+        prober = Prober(timeout=2, interval=0.05)
+        self.start(prober)
+        self.expected = 1
+        prober.probe('late', [('127.0.0.1', port)], self.callback)
+        time.sleep(0.2)
+        self.assertFalse(self.results)
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('127.0.0.1', port))
+        server.listen(16)
+        self.servers.append(server)
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.results, {'late': True})
+
+    def test_http(self):
+        server = listen()
+        self.servers.append(server)
+
+        def answer():
+            connection, unused = server.accept()
+            connection.recv(1024)
+            connection.sendall(b'HTTP/1.0 503 Service Unavailable\r\n\r\n')
+            connection.close()
+
+        thread = threading.Thread(target=answer)
+        thread.daemon = True
+        thread.start()
+        prober = Prober(kind='http', timeout=1, interval=0.05)
+        self.start(prober)
+        self.expected = 1
+        prober.probe('web', [server.getsockname()], self.callback)
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.results, {'web': True})
@@ -0,0 +1,49 @@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from workers.profiling import Profiler
+
+
+def work(depth):
+    if depth:
+        return work(depth - 1)
+    return sum(range(100))
+
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiler = Profiler(directory=self.directory, window=60,
+                                 name='test')
+
+    def tearDown(self):
+        self.profiler.stop()
+        shutil.rmtree(self.directory)
+
+    def test_off(self):
+        self.assertEqual(self.profiler.call(work, 2), 4950)
+        self.assertIsNone(self.profiler.stop())
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_window_is_dumped(self):
+        self.assertTrue(self.profiler.start())
+        self.assertFalse(self.profiler.start())
+        self.profiler.call(work, 1)
+        self.profiler.call(self.profiler.call, work, 1)
+        path = self.profiler.stop()
+        self.assertFalse(self.profiler.active)
+        self.assertEqual(os.path.dirname(path), self.directory)
+        functions = [function for unused, unused, function
+                     in pstats.Stats(path).stats.keys()]
+        self.assertIn('work', functions)
+
+    def test_toggle(self):
+        self.profiler.toggle()
+        self.assertTrue(self.profiler.active)
+        self.profiler.call(work, 0)
+        self.profiler.toggle()
+        self.assertFalse(self.profiler.active)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
@@ -0,0 +1,50 @@
+import unittest
+
+from mock import Mock
+
+from workers.manager.resources import ResourceSampler
+
+
+def make_stats(total_usage, system_usage, memory):
+    return {'cpu_stats': {'cpu_usage': {'total_usage': total_usage},
+                          'system_cpu_usage': system_usage},
+            'memory_stats': {'usage': memory}}
+
+
+class ResourceSamplerTest(unittest.TestCase):
+    def setUp(self):
+        self.docker = Mock()
+        self.docker.info.return_value = {'MemTotal': 1000}
+        self.stats = dict()
+        self.docker.stats.side_effect = \
+            lambda container_id, decode: iter([self.stats[container_id]])
+        self.sampler = ResourceSampler(self.docker,
+                                       lambda: list(self.stats.keys()),
+                                       threads=2, min_cpu=0.2,
+                                       min_memory=0.1)
+
+    def test_headroom(self):
+        self.assertTrue(self.sampler.has_headroom())
+        self.assertIsNone(self.sampler.score())
+        self.stats = {'c1': make_stats(0, 0, 300),
+                      'c2': make_stats(0, 0, 200)}
+        self.sampler.sample()
+        self.assertEqual(self.sampler.memory_headroom, 0.5)
+        self.assertEqual(self.sampler.cpu_headroom, 1.0)
+        self.stats = {'c1': make_stats(300, 1000, 300),
+                      'c2': make_stats(100, 1000, 200)}
+        self.sampler.sample()
+        self.assertAlmostEqual(self.sampler.cpu_headroom, 0.6)
+        self.assertEqual(self.sampler.score(), 0.5)
+        self.assertTrue(self.sampler.has_headroom())
+
+    def test_full_host(self):
+        self.stats = {'c1': make_stats(0, 0, 950)}
+        self.sampler.sample()
+        self.assertFalse(self.sampler.has_headroom())
+
+    def test_failed_read_is_skipped(self):
+        self.stats = {'c1': make_stats(0, 0, 100)}
+        self.docker.stats.side_effect = lambda container_id, decode: iter([])
+        self.sampler.sample()
+        self.assertEqual(self.sampler.memory_headroom, 1.0)
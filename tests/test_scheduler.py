@@ -0,0 +1,53 @@
+import threading
+import time
+import unittest
+
+from workers.scheduler import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler(jitter=0)
+        self.thread = threading.Thread(target=self.scheduler.run)
+        self.thread.daemon = True
+
+    def tearDown(self):
+        self.scheduler.stop()
+        self.thread.join(1)
+
+    def test_jobs_run_at_own_interval(self):
+        runs = {'fast': 0, 'slow': 0}
+
+        def count(name):
+            runs[name] += 1
+
+        self.scheduler.add('fast', lambda: count('fast'), 0.02)
+        self.scheduler.add('slow', lambda: count('slow'), 10)
+        self.thread.start()
+        time.sleep(0.4)
+        self.assertGreater(runs['fast'], 3)
+        self.assertEqual(runs['slow'], 1)
+
+    def test_overlapping_runs_are_skipped(self):
+        release = threading.Event()
+        runs = list()
+
+        def slow():
+            runs.append(1)
+            release.wait(1)
+
+        self.scheduler.add('slow', slow, 0.01)
+        self.thread.start()
+        time.sleep(0.1)
+        self.assertEqual(len(runs), 1)
+        release.set()
+
+    def test_stop_wakes_immediately(self):
+        self.scheduler.add('job', lambda: None, 60)
+        self.thread.start()
+        time.sleep(0.05)
+        started = time.time()
+        self.scheduler.stop()
+        self.thread.join(1)
+        self.assertFalse(self.thread.is_alive())
+        self.assertLess(time.time() - started, 0.5)
@@ -0,0 +1,66 @@
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+from tests.fakes import build_worker
+from workers.supervisor import _get_child_config, supervise
+
+
+class SupervisorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = {'worker': {'name': 'test', 'ports': '7000:7009',
+                                  'metrics_port': '9100',
+                                  'port_ledger': os.path.join(self.directory,
+                                                              'ports')},
+                       'persistence': {}}
+        self.handlers = dict((signum, signal.getsignal(signum)) for signum in
+                             (signal.SIGTERM, signal.SIGHUP, signal.SIGINT,
+                              signal.SIGUSR1))
+
+    def tearDown(self):
+        for signum, handler in self.handlers.items():
+            signal.signal(signum, handler)
+        shutil.rmtree(self.directory)
+
+    def test_child_config(self):
+        config = _get_child_config(self.config, 2)
+        self.assertEqual(config['worker']['process_index'], '2')
+        self.assertEqual(config['worker']['metrics_port'], '9102')
+        self.assertEqual(config['persistence']['cache'], 'False')
+        self.assertNotIn('process_index', self.config['worker'])
+
+    def test_supervise(self):
+        directory = self.directory
+
+        def run_worker(config):
+            index = config['worker']['process_index']
+            open(os.path.join(directory, 'started-' + index), 'w').close()
+            if index == '1':
+                while not os.path.exists(os.path.join(directory,
+                                                      'started-0')):
+                    time.sleep(0.01)
+                os.kill(os.getppid(), signal.SIGTERM)
+            time.sleep(10)
+
+        started = time.time()
+        supervise(self.config, run_worker, 2)
+        self.assertLess(time.time() - started, 5)
+        self.assertTrue(os.path.exists(os.path.join(directory, 'started-0')))
+        self.assertTrue(os.path.exists(os.path.join(directory, 'started-1')))
+
+    def test_only_primary_publishes_availability(self):
+        for index, published in (('0', 2), ('1', 0)):
+            worker, unused = build_worker(
+                'dummy', 1, {'process_index': index,
+                             'max_inflight_creates': '1'})
+            worker.running = True
+            worker._update_worker_status()
+            worker.admission.admit()
+            worker._update_worker_status()
+            subjects = [message[1] for message
+                        in worker.publish_manager.published]
+            self.assertEqual(subjects.count('instance_type'), published)
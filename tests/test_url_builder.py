@@ -36,3 +36,23 @@ class TestGenericUrlBuilder(unittest.TestCase):
         urls = builder.build(self.exist_connection)
         self.assertTrue(len(urls) == 1)
         self.assertTrue('exist' in urls[0])
+
+    def test_build_is_memoized(self):
+        builder = GenericUrlBuilder(
+            worker_conf={'formatting_string': EXIST_URL_FORMAT,
+                         'url_cache_size': '1'})
+        urls = builder.build(self.exist_connection)
+        urls.append('foo')
+        self.assertEqual(builder.build(self.exist_connection), urls[:1])
+        self.assertEqual(len(builder._cache), 1)
+        builder.build(self.neo_connection)
+        self.assertEqual(len(builder._cache), 1)
+
+    def test_build_keeps_template_path(self):
+        builder = GenericUrlBuilder(
+            worker_conf={'formatting_string': EXIST_URL_FORMAT})
+        urls = builder.build(
+            {u'8080/tcp': [{u'HostIp': u'10.0.0.1', u'HostPort': u'7000'}],
+             u'22/tcp': [{u'HostIp': u'10.0.0.1', u'HostPort': u'7001'}]})
+        self.assertEqual(sorted(urls), ['http://10.0.0.1:7000/exist',
+                                        'http://10.0.0.1:7001'])
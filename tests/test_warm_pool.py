@@ -0,0 +1,48 @@
+import itertools
+import unittest
+
+from mock import Mock
+
+from workers.manager.warm_pool import WarmPool
+
+
+class WarmPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.counter = itertools.count()
+        self.discard = Mock()
+        self.pool = WarmPool(size=2,
+                             prepare=lambda: next(self.counter),
+                             discard=self.discard)
+
+    def test_refill(self):
+        self.pool.refill()
+        self.assertEqual(self.pool.ready, 2)
+
+    def test_get(self):
+        self.assertIsNone(self.pool.get())
+        self.pool.refill()
+        self.assertEqual(self.pool.get(), 0)
+        stats = self.pool.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_refill_stops_without_resources(self):
+        pool = WarmPool(size=2, prepare=lambda: None, discard=self.discard)
+        pool.refill()
+        self.assertEqual(pool.ready, 0)
+
+    def test_drain(self):
+        self.pool.refill()
+        self.pool.drain()
+        self.assertEqual(self.pool.ready, 0)
+        self.assertEqual(self.discard.call_count, 2)
+        self.pool.refill()
+        self.assertEqual(self.pool.ready, 0)
+
+    def test_drain_discards_item_prepared_meanwhile(self):
+        pool = WarmPool(size=2, prepare=lambda: pool.drain() or 'item',
+                        discard=self.discard)
+        pool.refill()
+        self.assertEqual(pool.ready, 0)
+        self.discard.assert_called_once_with('item')
@@ -1,5 +1,16 @@
+import threading
+
+from collections import OrderedDict
+
 from furl import furl
 
+try:
+    from urlparse import urlsplit, urlunsplit
+except ImportError:
+    from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
 
 class GenericUrlBuilder(object):
 
@@ -11,9 +22,16 @@ class GenericUrlBuilder(object):
         :return:
         """
         self.service_url = dict()
+        self._templates = dict()
         if 'formatting_string' in worker_conf:
             for url in worker_conf['formatting_string'].split(';'):
                 self.service_url[url] = furl(url)
+                self._templates.setdefault(self.service_url[url].port,
+                                           _compile(self.service_url[url]))
+        self._default = _compile(furl('http://localhost'))
+        self.cache_size = int(worker_conf.get('url_cache_size', 1024))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
 
     def build(self, port_mapping):
         """
@@ -22,22 +40,53 @@ class GenericUrlBuilder(object):
         u'5672/tcp': [{u'HostPort': u'7001', u'HostIp': u'192.168.59.103'}]}
         :return: list of urls
         """
+        if not port_mapping:
+            return list()
+        key = tuple(
+            (internal_port, tuple((endpoint['HostIp'], endpoint['HostPort'])
+                                  for endpoint in port_mapping[internal_port]))
+            for internal_port in sorted(port_mapping.keys()))
+        with self._lock:
+            urls = self._cache.pop(key, None)
+            if urls is not None:
+                self._cache[key] = urls
+                return list(urls)
+        urls = self._build(key)
+        with self._lock:
+            self._cache[key] = urls
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return list(urls)
+
+    def _build(self, key):
         urls = list()
-        for internal_port in port_mapping.keys():
-            for index, unused in enumerate(port_mapping[internal_port]):
-                endpoint = port_mapping[internal_port][index]
-                port, proto = internal_port.split('/')
-                tmp_url = None
-                'if our internal url is part of a formatting template, use it'
-                for item in self.service_url.keys():
-                    if int(port) == self.service_url[item].port:
-                        tmp_url = self.service_url[item].copy()
-                        tmp_url.port = int(endpoint['HostPort'])
-                        tmp_url.host = endpoint['HostIp']
-                        break
-                'otherwise we create a url with http(most often default?)'
-                if not tmp_url:
-                    tmp_url = furl('http://{}:{}'.format(
-                        endpoint['HostIp'], endpoint['HostPort']))
-                urls.append(str(tmp_url))
+        for internal_port, endpoints in key:
+            port, proto = internal_port.split('/')
+            # use the formatting template of the internal port if there is
+            # one, otherwise we create a url with http(most often default?)
+            scheme, template = self._templates.get(int(port), self._default)
+            for host, host_port in endpoints:
+                host_port = int(host_port)
+                if DEFAULT_PORTS.get(scheme) == host_port:
+                    netloc = host
+                else:
+                    netloc = '{}:{}'.format(host, host_port)
+                urls.append(template.format(netloc))
         return urls
+
+
+def _compile(template):
+    """
+    turn a url template into a format string that only needs the netloc
+    :param template: furl of the template
+    :return: tuple of the scheme and the format string
+    """
+    scheme, netloc, path, query, fragment = urlsplit(str(template))
+    userinfo = ''
+    if '@' in netloc:
+        userinfo = netloc.rsplit('@', 1)[0] + '@'
+    parts = [part.replace('{', '{{').replace('}', '}}')
+             for part in (scheme, userinfo, path, query, fragment)]
+    scheme_part, userinfo, path, query, fragment = parts
+    return scheme, urlunsplit(
+        (scheme_part, userinfo + '{0}', path, query, fragment))
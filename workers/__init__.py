@@ -1,21 +1,31 @@
 import logging
-import random
-import string
+import threading
+import time
 
 from abc import ABCMeta, abstractmethod
-from time import sleep, ctime
+from time import ctime
 
 from metahosting.common import get_uuid
 from metahosting.common.messaging import get_message_subject
 from urlbuilders import GenericUrlBuilder
-from workers.manager.persistence import PersistenceManager
-from workers.manager.port import PortManager
+from workers.capture import MessageRecorder
+from workers.codec import get_codec
+from workers.environment import EnvironmentTemplate
+from workers.manager.admission import AdmissionController
+from workers.manager.persistence import INSTANCE_STATUS, PersistenceManager
+from workers.manager.port import PortManager, SharedPortManager
+from workers.metrics import REGISTRY, serve
+from workers.pool import DispatchPool, KeyedLock, SharedKeyedLock
+from workers.profiling import Profiler
+from workers.scheduler import Scheduler
 
+DISPATCH_SECONDS = REGISTRY.histogram(
+    'worker_dispatch_seconds', 'Duration of message callbacks by subject')
+PUBLISH_UPDATES_SECONDS = REGISTRY.histogram(
+    'worker_publish_updates_seconds', 'Duration of the instance update tick')
+STARTUP_SECONDS = REGISTRY.gauge(
+    'worker_startup_seconds', 'Duration of the worker startup by phase')
 
-def get_random_key(length=16):
-    return ''.join(
-        random.SystemRandom().choice(string.ascii_letters + string.digits)
-        for _ in range(length))
 
 callbacks = dict()
 
@@ -42,6 +52,7 @@ class Worker(object):
         :return: -
         """
         logging.debug('Worker initialization')
+        self._created = time.time()
 
         if 'disable_https_warnings' in config['worker']:
             import requests.packages.urllib3
@@ -56,24 +67,74 @@ class Worker(object):
         self.worker['description'] = self.config['worker']['description']
         self.worker['environment'] = \
             _load_instance_env(self.config['instance'])
-        self.port_manager = PortManager(self.config['worker'])
+        self.environment = EnvironmentTemplate(self.worker['environment'])
+        if 'port_ledger' in self.config['worker']:
+            self.port_manager = SharedPortManager(
+                self.config['worker'], self.config['worker']['port_ledger'])
+        else:
+            self.port_manager = PortManager(self.config['worker'])
+        self.primary = \
+            int(self.config['worker'].get('process_index', 0)) == 0
         self.url_builder = GenericUrlBuilder(self.config['worker'])
+        if 'port_ledger' in self.config['worker']:
+            # processes sharing the ports also share the instances
+            self.instance_lock = SharedKeyedLock(
+                self.config['worker']['port_ledger'] + '.locks')
+        else:
+            self.instance_lock = KeyedLock()
+        self.heartbeat_interval = float(
+            self.config['worker'].get('heartbeat_interval', 10))
+        self.reconcile_interval = float(
+            self.config['worker'].get('reconcile_interval', 10))
+        self.port_resync_interval = float(
+            self.config['worker'].get('port_resync_interval', 10))
+        self.compaction_interval = float(
+            self.config['worker'].get('compaction_interval', 3600))
+        self.profiler = Profiler(
+            directory=self.config['worker'].get('profile_dir'),
+            window=float(self.config['worker'].get('profile_window', 60)),
+            name=self.worker['name'])
+        self.scheduler = Scheduler(
+            jitter=float(self.config['worker'].get('schedule_jitter', 0.1)))
+        self.admission = AdmissionController(
+            max_in_flight=int(
+                self.config['worker'].get('max_inflight_creates', 0)),
+            capacity=self._capacity)
+        self._prefetch = None
+        self.batch_threads = int(
+            self.config['worker'].get('batch_threads', 8))
+        threads = int(self.config['worker'].get('dispatch_threads', 0))
+        if threads > 0:
+            self._pool = DispatchPool(threads)
+        else:
+            self._pool = None
+        if 'capture_file' in self.config['worker']:
+            self.recorder = MessageRecorder(
+                self.config['worker']['capture_file'])
+        else:
+            self.recorder = None
 
         self.publish_manager = messaging(
             config=self.config['messaging'],
             queue='info')
-        self.publish = self.publish_manager.publish
+        self._publish_lock = threading.Lock()
+        self._codecs = dict()
         self.subscribe_manager = messaging(config=self.config['messaging'],
                                            queue=self.worker['name'])
         self.local_persistence = PersistenceManager(
             config=self.config['persistence'],
             backend=persistence,
             publish=self.publish)
+        REGISTRY.gauge('worker_ports_free', 'Free ports of the port range')\
+            .set_function(lambda: self.port_manager.free_count)
+        REGISTRY.gauge('worker_ports_total', 'Ports of the port range')\
+            .set_function(lambda: self.port_manager.size)
 
     def start(self):
         """
-        start thread that is sending all information to the queue and at the
-        same time subscribe for create_instance messages on own queue
+        subscribe for create_instance messages on own queue and at the same
+        time run the heartbeat, instance updates and port resync, each at
+        its own interval, until the worker is stopped
         :return:
         """
         self.running = True
@@ -81,14 +142,27 @@ class Worker(object):
         self.worker['available'] = True
         self.worker['status'] = 'Worker available'
         self.subscribe_manager.subscribe(self.worker['name'], self._dispatch)
-        while self.running:
-            logging.info('Publishing type and status updates: %s',
-                         self.worker['name'])
-            self._publish_updates()
-            self._publish_type()
-            sleep(10)
+        self._start_background()
+        STARTUP_SECONDS.set(time.time() - self._created, phase='total')
+        logging.info('Worker started in %.2fs', time.time() - self._created)
+        if self.primary:
+            self._add_jobs()
+        else:
+            logging.info('Leaving scheduled jobs to the first process')
+        self.scheduler.run()
         logging.info('Worker stopped at %s', ctime())
 
+    def _add_jobs(self):
+        self.scheduler.add('heartbeat', self._publish_type,
+                           self.heartbeat_interval)
+        self.scheduler.add('instance_updates', self._timed_publish_updates,
+                           self.reconcile_interval)
+        self.scheduler.add('port_resync', self._resync_ports,
+                           self.port_resync_interval)
+        if self.local_persistence.retention:
+            self.scheduler.add('compaction', self.local_persistence.compact,
+                               self.compaction_interval)
+
     def stop(self, signal, stack):
         """
         try to catch a SIGTERM signal in main thread and stop.
@@ -98,19 +172,122 @@ class Worker(object):
         """
         self.worker['available'] = False
         self.worker['status'] = 'Worker not available'
-        self._publish_type()
+        if self.primary:
+            self._publish_type()
         self.publish_manager.disconnect()
         self.running = False
+        self.scheduler.stop()
+        if self._pool:
+            self._pool.shutdown()
+        self.local_persistence.flush()
+        if self.recorder:
+            self.recorder.close()
         logging.info('Worker stopping with signal %s', signal)
 
     @callback('create_instance')
-    def create(self, message):
-        self.create_instance(message)
+    def create(self, message, wait=False):
+        """
+        :param message: create_instance message body
+        :param wait: bool, wait for a free in-flight slot, see
+        AdmissionController.admit
+        :return: -
+        """
+        stored = self.local_persistence.get_instance(message['id'])
+        if stored is not None and \
+                stored['status'] == INSTANCE_STATUS.DELETED:
+            logging.warning('Instance %s was deleted before its create, '
+                            'not creating it', message['id'])
+            return
+        if not self.admission.admit(wait=wait):
+            self.local_persistence.update_instance_status(
+                instance=message.copy(),
+                status=INSTANCE_STATUS.FAILED)
+            self._update_worker_status()
+            return
+        self._update_worker_status()
+        try:
+            self.create_instance(message)
+        finally:
+            self.admission.release()
+            self._update_worker_status()
 
     @callback('delete_instance')
     def delete(self, message):
         self.delete_instance(message)
 
+    @callback('create_instances')
+    def create_batch(self, message):
+        self.create_instances(_get_batch(message))
+
+    @callback('delete_instances')
+    def delete_batch(self, message):
+        self.delete_instances(_get_batch(message))
+
+    @callback('profile')
+    def profile(self, message):
+        """
+        start or stop profiling, message action is start or stop, window
+        the optional number of seconds to profile
+        """
+        if message.get('action') == 'stop':
+            self.profiler.stop()
+        else:
+            self.profiler.start(window=message.get('window'))
+
+    def create_instances(self, messages):
+        """
+        create many instances at once, each admitted on its own. Items wait
+        for a free slot when max_inflight_creates are going on, and are only
+        rejected when the worker runs out of capacity.
+        :param messages: list of create_instance message bodies
+        :return: -
+        """
+        threads = self.batch_threads
+        if self.admission.max_in_flight:
+            threads = min(threads, self.admission.max_in_flight)
+        self._run_batch(lambda message: self.create(message, wait=True),
+                        messages, threads)
+
+    def delete_instances(self, messages):
+        """
+        delete many instances at once, workers that can share the docker or
+        store work between the instances override this
+        :param messages: list of delete_instance message bodies
+        :return: -
+        """
+        self._run_batch(self.delete_instance, messages)
+
+    def _run_batch(self, function, messages, threads=None):
+        """
+        call function for every message, on up to batch_threads threads, and
+        publish the resulting instances as one instance_info_batch message
+        :param function: function taking one message
+        :param messages: list of message bodies with an id each
+        :param threads: number of threads, batch_threads if None
+        :return: -
+        """
+        logging.info('Running a batch of %d instances', len(messages))
+        threads = min(threads or self.batch_threads, len(messages))
+        with self.local_persistence.batch() as pending:
+            if threads <= 1:
+                for message in messages:
+                    self._run_batch_item(function, message, pending)
+                return
+            pool = DispatchPool(threads, name='batch')
+            for message in messages:
+                pool.submit(self._run_batch_item, function, message, pending)
+            pool.join()
+            pool.shutdown()
+
+    def _run_batch_item(self, function, message, pending):
+        with self.local_persistence.collect(pending):
+            with self.instance_lock(message['id']):
+                try:
+                    function(message)
+                except Exception:
+                    logging.exception('Error in batch for instance %s',
+                                      message['id'])
+
     @abstractmethod
     def create_instance(self, message):
         pass
@@ -123,34 +300,142 @@ class Worker(object):
     def _publish_updates(self):
         pass
 
+    def _timed_publish_updates(self):
+        logging.info('Publishing instance updates: %s', self.worker['name'])
+        with PUBLISH_UPDATES_SECONDS.time():
+            self.profiler.call(self._publish_updates)
+
+    def _resync_ports(self):
+        """
+        bring the port bookkeeping in line with the ports actually in use,
+        workers that manage ports implement this
+        :return: -
+        """
+        pass
+
+    def _start_background(self):
+        """
+        start the threads running next to the update loop, workers with
+        threads of their own extend this
+        :return: -
+        """
+        if 'metrics_port' in self.config['worker']:
+            serve(REGISTRY, self.config['worker']['metrics_port'],
+                  host=self.config['worker'].get('metrics_host',
+                                                 '127.0.0.1'))
+
+    def publish(self, queue, subject, message):
+        """
+        send a message through the publish connection, which is shared by
+        the update loop and the dispatch threads, encoded with the codec
+        configured for the queue
+        """
+        if queue not in self._codecs:
+            self._codecs[queue] = get_codec(self.config['worker'], queue)
+        message = self._codecs[queue].encode(message)
+        with self._publish_lock:
+            self.publish_manager.publish(queue, subject, message)
+
     def _publish_type(self):
+        self.worker['metrics'] = REGISTRY.summary()
         self.publish('info', 'instance_type', {'type': self.worker})
 
+    def _update_worker_status(self):
+        """
+        set the available flag from the admission capacity and publish the
+        type right away when it flipped; only the first process publishes,
+        the others share its name and uuid
+        :return: -
+        """
+        available = self.admission.has_capacity()
+        changed = available != self.worker.get('available')
+        self.worker['available'] = available
+        if available:
+            self.worker['status'] = 'Worker available'
+        else:
+            self.worker['status'] = 'Worker unavailable, ' \
+                                    'to many resources in use'
+        if changed and self.running and self.primary:
+            self._publish_type()
+
+    def _capacity(self):
+        """
+        number of further instances the resources of the worker allow,
+        workers with limited resources implement this
+        :return: int, None for no limit
+        """
+        return None
+
+    def _apply_prefetch(self):
+        """
+        limit the messages the broker pushes to us to the creates we can
+        still admit. Only applies when max_inflight_creates is set and the
+        messaging backend exposes its channel, and runs on the consumer
+        thread, which owns the channel.
+        :return: -
+        """
+        channel = getattr(self.subscribe_manager, 'channel', None)
+        if channel is None or not self.admission.max_in_flight:
+            return
+        # a prefetch count of 0 would mean no limit at all
+        prefetch = max(self.admission.free_slots(), 1)
+        if prefetch != self._prefetch:
+            channel.basic_qos(prefetch_count=prefetch)
+            self._prefetch = prefetch
+
     def _dispatch(self, message):
+        if self.recorder:
+            self.recorder.record(message)
+        self._apply_prefetch()
         subject = get_message_subject(message)
         global callbacks
         if subject in callbacks:
-            callbacks[subject](self, message)
+            if self._pool:
+                self._pool.submit(self._run_callback, subject, message)
+            else:
+                self._run_callback(subject, message)
         else:
             logging.error('No callback for %s found!', subject)
 
-    def _create_instance_env(self):
+    def _run_callback(self, subject, message):
+        """
+        run a callback while holding the lock of the instance it is about,
+        so a create and a delete of the same instance never overlap
+        """
+        with DISPATCH_SECONDS.time(subject=subject):
+            with self.instance_lock(message.get('id')):
+                self.profiler.call(callbacks[subject], self, message)
+
+    def _mark_unknown_deleted(self, instance_id):
+        """
+        store a delete of an instance that is not stored (yet), so a create
+        handled after it, e.g. by another process or dispatch thread, does
+        not bring the instance back
+        :param instance_id: id of the instance
+        :return: -
+        """
+        logging.warning('Unknown instance id: %s', instance_id)
+        self.local_persistence.update_instance_status(
+            {'id': instance_id}, INSTANCE_STATUS.DELETED, publish=False)
+
+    def _create_instance_env(self, ports=()):
         """
-        Merge the worker env with the incarnation of the instance
+        render the environment of a new instance from the compiled
+        [instance_environment] template
+        :param ports: host ports of the instance, for INJECT_PORT
         :return: list containing key=value pairs send to instance
         """
-        worker_env = self.worker['environment']
-        logging.error('WORKER_ENV: %s', worker_env)
-        instance_env = []
-        for key in worker_env.keys():
-            if worker_env[key] == '':
-                instance_env.append(key + '=' + get_random_key())
-            else:
-                instance_env.append(key + '=' + worker_env[key])
-        logging.debug('Current environment for VM: %s', instance_env)
+        return self.environment.render(ports)
+
 
-        logging.error('INSTANCE_ENV: %s', instance_env)
-        return instance_env
+def _get_batch(message):
+    """
+    :param message: dict, either with a list of instances or of ids
+    :return: list of message bodies, one per instance
+    """
+    if 'instances' in message:
+        return list(message['instances'])
+    return [{'id': instance_id} for instance_id in message.get('ids', [])]
 
 
 def _load_instance_env(instance_env=None):
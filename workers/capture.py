@@ -0,0 +1,59 @@
+import json
+import logging
+import threading
+import time
+
+
+class MessageRecorder(object):
+    """
+    appends every message handed to the worker to a file, one compact JSON
+    line [timestamp, message] per message, so incidents can be replayed
+    with tests.replay. Lines are flushed as they are written; a worker that
+    restarts keeps appending to the same file.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the recording, created if missing
+        :return: -
+        """
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+        logging.info('Recording messages to %s', path)
+
+    def record(self, message):
+        """
+        :param message: message as the messaging backend hands it over
+        :return: -
+        """
+        line = json.dumps([time.time(), message], separators=(',', ':'),
+                          default=str)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_recording(path):
+    """
+    :param path: path of a recording
+    :return: generator of (timestamp, message) tuples, skipping a torn
+    last line left by a worker that was killed while writing
+    """
+    with open(path) as recording:
+        for number, line in enumerate(recording, 1):
+            try:
+                timestamp, message = json.loads(line)
+            except ValueError:
+                logging.warning('Skipping broken line %d of %s',
+                                number, path)
+                continue
+            yield timestamp, message
@@ -0,0 +1,88 @@
+import base64
+import json
+import logging
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SERIALIZERS = ('json', 'msgpack')
+COMPRESSIONS = ('', 'zlib')
+
+
+class Codec(object):
+    """
+    encodes the body of published messages. json without compression keeps
+    the body as it is, anything else wraps it into an envelope
+    {'codec': ..., 'compression': ..., 'payload': base64 string}, which
+    consumers unpack with decode.
+    """
+
+    def __init__(self, name='json', compress_min_size=4096):
+        """
+        :param name: serializer and optional compression, e.g. msgpack+zlib
+        :param compress_min_size: bodies smaller than this many bytes are
+        not compressed
+        :return: -
+        """
+        serializer, unused, compression = name.partition('+')
+        if serializer not in SERIALIZERS or compression not in COMPRESSIONS:
+            raise ValueError('Unknown message codec {}'.format(name))
+        if serializer == 'msgpack' and msgpack is None:
+            logging.error('msgpack is not installed, publishing json')
+            serializer = 'json'
+        self.serializer = serializer
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+
+    def encode(self, message):
+        """
+        :param message: dict, the message body
+        :return: dict, the body to publish
+        """
+        if self.serializer == 'json' and not self.compression:
+            return message
+        data = _dumps(self.serializer, message)
+        compression = None
+        if self.compression and len(data) >= self.compress_min_size:
+            data = zlib.compress(data)
+            compression = self.compression
+        elif self.serializer == 'json':
+            return message
+        return {'codec': self.serializer,
+                'compression': compression,
+                'payload': base64.b64encode(data).decode('ascii')}
+
+
+def get_codec(config, queue):
+    """
+    :param config: worker part of the config
+    :param queue: name of the queue
+    :return: Codec set by message_codec_<queue>, or else message_codec
+    """
+    name = config.get('message_codec_' + queue,
+                      config.get('message_codec', 'json'))
+    return Codec(name, int(config.get('compress_min_size', 4096)))
+
+
+def decode(message):
+    """
+    :param message: dict, a published message body
+    :return: dict, the body before encoding
+    """
+    if 'codec' not in message or 'payload' not in message:
+        return message
+    data = base64.b64decode(message['payload'])
+    if message.get('compression') == 'zlib':
+        data = zlib.decompress(data)
+    if message['codec'] == 'msgpack':
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data.decode('utf-8'))
+
+
+def _dumps(serializer, message):
+    if serializer == 'msgpack':
+        return msgpack.packb(message, use_bin_type=True, default=str)
+    return json.dumps(message, default=str).encode('utf-8')
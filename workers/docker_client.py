@@ -0,0 +1,234 @@
+import logging
+import os
+import threading
+import time
+
+import docker.errors
+import requests
+import requests.exceptions
+from docker.client import AutoVersionClient, Client
+from docker.tls import TLSConfig
+from docker.unixconn import unixconn
+from docker.utils import utils
+
+from workers.metrics import REGISTRY
+
+# calls that can be repeated without changing the outcome
+IDEMPOTENT_CALLS = frozenset(['containers', 'images', 'info',
+                              'inspect_container', 'inspect_image', 'stats',
+                              'version'])
+
+# statuses of a proxy or daemon that is overloaded or not reachable; older
+# daemons answer ordinary errors with a 500, so it is not one of them
+TRANSIENT_STATUSES = frozenset([502, 503, 504])
+
+RETRIES = REGISTRY.counter(
+    'worker_docker_retries_total', 'Retried Docker API calls by method')
+CIRCUIT_OPEN = REGISTRY.gauge(
+    'worker_docker_circuit_open', '1 while Docker calls are suspended')
+
+
+class DockerUnavailable(docker.errors.DockerException):
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    stops calls to a failing service for a cooldown period once threshold
+    calls in a row failed, then lets one call through to probe it again
+    """
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self._lock = threading.Lock()
+
+    @property
+    def open(self):
+        return self.opened is not None and \
+            time.time() - self.opened < self.cooldown
+
+    def allow(self):
+        """
+        :return: bool, False while the breaker is open
+        """
+        with self._lock:
+            if self.opened is None:
+                return True
+            if time.time() - self.opened >= self.cooldown:
+                # half open, the next failure opens it again right away
+                self.failures = self.threshold - 1
+                self.opened = None
+                CIRCUIT_OPEN.set(0)
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold and self.opened is None:
+                logging.error('Docker failed %d times in a row, suspending '
+                              'calls for %ss', self.failures, self.cooldown)
+                self.opened = time.time()
+                CIRCUIT_OPEN.set(1)
+
+
+class DockerClient(object):
+    """
+    wrapper around the docker-py client that pins or caches the API
+    version, sizes the connection pool to the worker concurrency, retries
+    idempotent calls with bounded backoff and trips a circuit breaker when
+    the daemon keeps failing
+    """
+
+    def __init__(self, config, pool_size=10, histogram=None, profiler=None):
+        """
+        :param config: worker part of the config
+        :param pool_size: connections kept to the daemon
+        :param histogram: metrics histogram timing the calls by method
+        :param profiler: Profiler the calls are run under
+        :return: -
+        """
+        self.retries = int(config.get('docker_retries', 2))
+        self.backoff = float(config.get('docker_backoff', 0.1))
+        self.breaker = CircuitBreaker(
+            threshold=int(config.get('docker_failure_threshold', 5)),
+            cooldown=float(config.get('docker_cooldown', 30)))
+        self._histogram = histogram
+        self._profiler = profiler
+        self._client = _connect(config)
+        if isinstance(self._client, requests.Session):
+            _size_pool(self._client, config['docker_url'],
+                       int(config.get('docker_pool_size', pool_size)))
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            if self._profiler is not None and self._profiler.active:
+                return self._profiler.call(self._timed_call, name, attribute,
+                                           args, kwargs)
+            return self._timed_call(name, attribute, args, kwargs)
+        return call
+
+    def _timed_call(self, name, function, args, kwargs):
+        if self._histogram is None:
+            return self._call(name, function, args, kwargs)
+        with self._histogram.time(method=name):
+            return self._call(name, function, args, kwargs)
+
+    def _call(self, name, function, args, kwargs):
+        if not self.breaker.allow():
+            raise DockerUnavailable('Docker calls suspended after failures')
+        attempt = 0
+        while True:
+            try:
+                result = function(*args, **kwargs)
+            except Exception as err:
+                if not _is_transient(err):
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                if name not in IDEMPOTENT_CALLS or \
+                        attempt >= self.retries or not self.breaker.allow():
+                    raise
+                logging.debug('Retrying %s after %s', name, err)
+                RETRIES.inc(method=name)
+                time.sleep(min(self.backoff * 2 ** attempt, 2))
+                attempt += 1
+            else:
+                self.breaker.success()
+                return result
+
+
+def _connect(config):
+    """
+    create the docker-py client. The API version is taken from
+    docker_api_version if set, otherwise from the file named by
+    docker_api_version_cache, and only negotiated with the daemon when
+    neither is there.
+    """
+    tls = _get_tls(config)
+    version = config.get('docker_api_version')
+    cache = config.get('docker_api_version_cache')
+    if not version and cache and os.path.exists(cache):
+        with open(cache) as cache_file:
+            version = cache_file.read().strip()
+    if version:
+        return Client(base_url=config['docker_url'], version=version,
+                      tls=tls)
+    client = AutoVersionClient(base_url=config['docker_url'], tls=tls)
+    if cache:
+        try:
+            with open(cache, 'w') as cache_file:
+                cache_file.write(client._version)
+        except (IOError, TypeError) as err:
+            logging.warning('Not able to cache docker API version: %s', err)
+    return client
+
+
+def _size_pool(client, docker_url, size):
+    """
+    let the client keep up to size connections to the daemon, instead of
+    the default of one for unix sockets
+    """
+    base_url = utils.parse_host(docker_url)
+    if base_url.startswith('http+unix://'):
+        client.mount('http+docker://',
+                     _UnixAdapter(base_url, client.timeout, size))
+    else:
+        adapter = client.get_adapter(client.base_url)
+        adapter._pool_maxsize = size
+        adapter.init_poolmanager(adapter._pool_connections, size)
+
+
+class _UnixAdapter(unixconn.UnixAdapter):
+    def __init__(self, socket_url, timeout, maxsize):
+        super(_UnixAdapter, self).__init__(socket_url, timeout)
+        self.maxsize = maxsize
+
+    def get_connection(self, url, proxies=None):
+        with self.pools.lock:
+            pool = self.pools.get(url)
+            if pool:
+                return pool
+            pool = unixconn.UnixHTTPConnectionPool(url,
+                                                   self.socket_path,
+                                                   self.timeout)
+            pool.pool = pool.QueueCls(self.maxsize)
+            for unused in range(self.maxsize):
+                pool.pool.put(None)
+            self.pools[url] = pool
+        return pool
+
+
+def _is_transient(err):
+    """
+    :return: bool, whether the error says the daemon is unreachable or
+    struggling rather than that the request was wrong
+    """
+    if isinstance(err, docker.errors.APIError):
+        return err.response is not None and \
+            err.response.status_code in TRANSIENT_STATUSES
+    return isinstance(err, (requests.exceptions.ConnectionError,
+                            requests.exceptions.Timeout))
+
+
+def _get_tls(config):
+    keys = config.keys()
+    if 'client_cert' in keys and 'client_key' in keys \
+            and 'tls_verify' in keys:
+        if config['tls_verify'] == 'True':
+            verify = True
+        else:
+            verify = False
+        return TLSConfig(client_cert=(
+            config['client_cert'], config['client_key'],), verify=verify)
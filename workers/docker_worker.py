@@ -1,9 +1,27 @@
-from docker.client import AutoVersionClient
-from docker.tls import TLSConfig
 import docker.errors
 import logging
+import requests.exceptions
+import threading
+import time
+from workers.manager.lease import LeaseChecker, get_lease
 from workers.manager.persistence import INSTANCE_STATUS
-from workers import Worker
+from workers.manager.probe import Prober
+from workers.manager.resources import ResourceSampler
+from workers.manager.warm_pool import WarmPool
+from workers.docker_client import DockerClient
+from workers.metrics import REGISTRY
+from workers import STARTUP_SECONDS, Worker
+
+CONTAINER_EVENTS = ('start', 'die', 'kill', 'destroy')
+POOL_LABEL = 'metahosting.warm_pool'
+PORTS_LABEL = 'metahosting.ports'
+# statuses of instances that have a container
+LIVE_STATUS = (INSTANCE_STATUS.STARTING, INSTANCE_STATUS.RUNNING)
+# statuses of instances that hold the ports of their lease
+LEASE_STATUS = LIVE_STATUS + (INSTANCE_STATUS.STOPPED,)
+
+DOCKER_SECONDS = REGISTRY.histogram(
+    'worker_docker_request_seconds', 'Docker API calls by method')
 
 
 class DockerWorker(Worker):
@@ -17,90 +35,404 @@ class DockerWorker(Worker):
                                            persistence=persistence,
                                            messaging=messaging)
         logging.debug('DockerWorker initialization')
-        self.docker = AutoVersionClient(
-            base_url=self.config['worker']['docker_url'],
-            tls=_get_tls(config['worker']))
+        self.docker = DockerClient(
+            config['worker'],
+            pool_size=_get_pool_size(config['worker'], self.batch_threads),
+            histogram=DOCKER_SECONDS,
+            profiler=self.profiler)
+        self._events = config['worker'].get('docker_events') == 'True'
+        if self._events and 'reconcile_interval' not in config['worker']:
+            self.reconcile_interval = 60
+        self._containers = dict()
         self._image_ports = self._initialize_image()
-        self._get_all_allocated_ports()
+        self._lease_checker = LeaseChecker(
+            grace=float(config['worker'].get('port_lease_grace', 60)))
+        self._load_leases()
+        if config['worker'].get('readiness_probe'):
+            self._prober = Prober(
+                kind=config['worker']['readiness_probe'],
+                path=config['worker'].get('probe_path', '/'),
+                timeout=float(config['worker'].get('probe_timeout', 60)))
+            self._probe_host = config['worker'].get(
+                'probe_host', config['worker'].get('ip', '127.0.0.1'))
+        else:
+            self._prober = None
+        if config['worker'].get('resource_sampling') == 'True':
+            self._sampler = ResourceSampler(
+                self.docker, self._get_running_containers,
+                threads=int(config['worker'].get('sampler_threads', 4)),
+                min_cpu=float(config['worker'].get('min_cpu_headroom', 0)),
+                min_memory=float(
+                    config['worker'].get('min_memory_headroom', 0)))
+            self.sample_interval = float(
+                config['worker'].get('sample_interval', 30))
+        else:
+            self._sampler = None
+        pool_size = int(config['worker'].get('warm_pool_size', 0))
+        self._pool_owner = self.worker['name']
+        if 'process_index' in config['worker']:
+            self._pool_owner += '-' + config['worker']['process_index']
+        if pool_size > 0:
+            self._remove_pool_containers()
+            self._warm_pool = WarmPool(
+                size=pool_size,
+                prepare=lambda: self._prepare_container(
+                    labels={POOL_LABEL: self._pool_owner}),
+                discard=self._discard_container)
+        else:
+            self._warm_pool = None
+
+    def stop(self, signal, stack):
+        """
+        stop the worker and remove the containers of the warm pool, so their
+        ports are free for the next start
+        :param signal:
+        :param stack:
+        :return:
+        """
+        super(DockerWorker, self).stop(signal, stack)
+        if self._warm_pool:
+            self._warm_pool.drain()
 
     def create_instance(self, message):
         instance = message.copy()
         logging.info('Creating instance id: %s', instance['id'])
-        environment = self._create_instance_env()
-        ports = self.port_manager.acquire_ports(len(self._image_ports))
-        environment = _check_instance_env_port_injection(
-            environment=environment,
-            ports=ports)
-        if ports:
-            port_mapping = dict(zip(self._image_ports, ports))
-            container = self.docker.create_container(self.worker['image'],
-                                                     environment=environment,
-                                                     ports=self._image_ports)
-            self.docker.start(container, port_bindings=port_mapping)
-            instance['container_id'] = container['Id']
-            instance['environment'] = environment
-            self._set_networking(instance=instance)
-            self.local_persistence.update_instance_status(
-                instance=instance,
-                status=INSTANCE_STATUS.STARTING)
+        prepared = None
+        if self._warm_pool:
+            prepared = self._warm_pool.get()
+            if prepared is not None:
+                self.admission.acquired()
+        if prepared is None:
+            prepared = self._prepare_container()
+        if prepared:
+            container = prepared['container']
+            port_mapping = dict(zip(self._image_ports, prepared['ports']))
+            with self.instance_lock(instance['id']):
+                self._containers[container['Id']] = instance['id']
+                try:
+                    self.docker.start(container, port_bindings=port_mapping)
+                except Exception:
+                    logging.exception('Not able to start container for '
+                                      'instance %s', instance['id'])
+                    self._abandon_container(prepared)
+                    self.local_persistence.update_instance_status(
+                        instance=instance,
+                        status=INSTANCE_STATUS.FAILED)
+                    return
+                instance['container_id'] = container['Id']
+                instance['environment'] = prepared['environment']
+                instance['lease'] = get_lease(prepared['ports'],
+                                              container['Id'])
+                self._set_networking(instance=instance)
+                self.local_persistence.update_instance_status(
+                    instance=instance,
+                    status=INSTANCE_STATUS.STARTING)
+                if self._prober:
+                    self._start_probe(instance)
         else:
             self.local_persistence.update_instance_status(
                 instance=instance,
                 status=INSTANCE_STATUS.FAILED)
 
+    def _prepare_container(self, labels=None):
+        """
+        acquire ports and create, but not start, a container for them. The
+        ports are put on the container as a label, so they count as taken
+        while it waits in the warm pool.
+        :param labels: dict, labels of the container
+        :return: dict with container, ports and environment, None if there
+        are not enough ports left
+        """
+        ports = self.port_manager.acquire_ports(len(self._image_ports))
+        if not ports:
+            return None
+        self.admission.acquired()
+        environment = self._create_instance_env(ports)
+        labels = dict(labels or {})
+        labels[PORTS_LABEL] = ','.join(str(port) for port in ports)
+        try:
+            container = self.docker.create_container(self.worker['image'],
+                                                     environment=environment,
+                                                     ports=self._image_ports,
+                                                     labels=labels)
+        except Exception:
+            self.port_manager.release_ports(ports)
+            raise
+        return {'container': container,
+                'ports': ports,
+                'environment': environment}
+
+    def _abandon_container(self, prepared):
+        """
+        remove a container that failed to start and release its ports, so
+        its label does not keep them reserved
+        :param prepared: dict as returned by _prepare_container
+        :return: -
+        """
+        container_id = prepared['container']['Id']
+        self._containers.pop(container_id, None)
+        try:
+            self.docker.remove_container(container_id, force=True)
+        except Exception:
+            logging.exception('Not able to remove container %s',
+                              container_id)
+        self.port_manager.release_ports(prepared['ports'])
+
+    def _discard_container(self, prepared):
+        self.docker.remove_container(prepared['container'])
+        self.port_manager.release_ports(prepared['ports'])
+
+    def _remove_pool_containers(self):
+        """
+        remove containers a previous run prepared for its warm pool but
+        never handed out, and release the ports in their label, which the
+        startup marked used
+        :return: -
+        """
+        in_use = set(instance.get('container_id') for instance in
+                     self.local_persistence.get_instances().values())
+        for container in self.docker.containers(
+                all=True,
+                filters={'label': '{}={}'.format(POOL_LABEL,
+                                                 self._pool_owner)}):
+            if container['Id'] not in in_use:
+                logging.debug('Removing pool container %s', container['Id'])
+                self.docker.remove_container(container)
+                self.port_manager.release_ports(_get_label_ports(container))
+
     def delete_instance(self, message):
+        with self.instance_lock(message['id']):
+            self._delete_instance(message)
+
+    def _delete_instance(self, message):
         msg = message.copy()
         instance = self.local_persistence.get_instance(msg['id'])
-        if instance['status'] == INSTANCE_STATUS.RUNNING:
+        if instance is None:
+            self._mark_unknown_deleted(msg['id'])
+            return
+        if self._prober:
+            self._prober.cancel(msg['id'])
+        ports = set()
+        if instance['status'] in LEASE_STATUS:
+            ports.update(_get_lease_ports(instance))
+        if instance['status'] in LIVE_STATUS:
             logging.info('Deleting instance id: %s', msg['id'])
             container = self._get_container(
                 container_id=instance['container_id'])
-            if not container:
+            if container:
+                ports.update(
+                    self._get_container_ports(instance['container_id']))
+                self.docker.kill(container)
+                self.docker.remove_container(container)
+            else:
                 logging.debug('Container does not exist, not stopping it')
-                return
-            free_ports = self._get_container_ports(instance['container_id'])
-            self.docker.kill(container)
-            self.docker.remove_container(container)
-            self.port_manager.release_ports(free_ports)
-            self.local_persistence.update_instance_status(
-                instance=instance,
-                status=INSTANCE_STATUS.DELETED)
-        else:
-            self.local_persistence.update_instance_status(
-                instance=instance,
-                status=INSTANCE_STATUS.DELETED)
+            self._containers.pop(instance['container_id'], None)
+        self.port_manager.release_ports(ports)
+        self.local_persistence.update_instance_status(
+            instance=instance,
+            status=INSTANCE_STATUS.DELETED)
+
+    def delete_instances(self, messages):
+        """
+        delete many instances with one container listing instead of two
+        inspects each, one forced remove per container and one release of
+        all their ports at the end
+        :param messages: list of delete_instance message bodies
+        :return: -
+        """
+        index = self._get_container_index()
+        released = list()
+
+        def delete(message):
+            released.extend(self._delete_listed_instance(message, index))
+        self._run_batch(delete, messages)
+        self.port_manager.release_ports(released)
+        self._update_worker_status()
+
+    def _delete_listed_instance(self, message, index):
+        """
+        :param message: delete_instance message body
+        :param index: container index taken before the batch started
+        :return: list of the ports the container used
+        """
+        instance = self.local_persistence.get_instance(message['id'])
+        if instance is None:
+            self._mark_unknown_deleted(message['id'])
+            return []
+        ports = set()
+        if instance['status'] in LEASE_STATUS:
+            ports.update(_get_lease_ports(instance))
+        if self._prober:
+            self._prober.cancel(message['id'])
+        if instance['status'] in LIVE_STATUS:
+            logging.info('Deleting instance id: %s', message['id'])
+            container = index.get(instance['container_id'])
+            if container is not None:
+                self.docker.remove_container(instance['container_id'],
+                                             force=True)
+                ports.update(_get_ports(container['networking']))
+            else:
+                logging.debug('Container does not exist, not stopping it')
+            self._containers.pop(instance['container_id'], None)
+        self.local_persistence.update_instance_status(
+            instance=instance,
+            status=INSTANCE_STATUS.DELETED)
+        return list(ports)
 
     def _initialize_image(self):
         """
-        download a docker image and get the ports that we have to link
+        make sure the docker image is there and get the ports that we have
+        to link. Following image_pull, a missing image is always pulled
+        first; a present one is pulled again in the background once the
+        worker runs (background, the default), before it starts (always) or
+        not at all (missing), which keeps serving a stale image until it is
+        removed locally.
         :return: list of ports(str)
         """
         logging.info('Initializing image %s', self.config['worker']['image'])
+        started = time.time()
         self.worker['image'] = self.config['worker']['image']
+        policy = self.config['worker'].get('image_pull', 'background')
+        docker_image = self._inspect_image()
+        self._pull_in_background = False
+        if docker_image is None or policy == 'always':
+            self._pull_image()
+            docker_image = self.docker.inspect_image(self.worker['image'])
+        else:
+            logging.info('Image %s present locally', self.worker['image'])
+            self._pull_in_background = policy == 'background'
+        self.worker['image_id'] = docker_image.get(u'Id')
+        STARTUP_SECONDS.set(time.time() - started, phase='image')
+        return _get_exposed_ports(docker_image)
+
+    def _inspect_image(self):
+        """
+        :return: dict, the local image, None if it is not there
+        """
+        try:
+            return self.docker.inspect_image(self.worker['image'])
+        except docker.errors.APIError as err:
+            if err.response is None or not err.is_client_error():
+                raise
+            return None
+
+    def _pull_image(self):
+        logging.info('Pulling image %s', self.worker['image'])
         tmp = self.worker['image'].split(':')
         if len(tmp) == 2:
             self.docker.import_image(image=tmp[0], tag=tmp[1])
         else:
             self.docker.import_image(image=tmp)
-        logging.debug('Extracting ports from image')
-        ports = []
-        docker_image = self.docker.inspect_image(self.worker['image'])
-        for port in docker_image[u'ContainerConfig'][u'ExposedPorts'].keys():
-            ports.append(port.split('/')[0])
-        return ports
+
+    def _refresh_image(self):
+        """
+        pull the image while the worker already serves the queue. Containers
+        created afterwards use the new image; ports exposed differently only
+        apply after a restart.
+        :return: -
+        """
+        try:
+            self._pull_image()
+            docker_image = self.docker.inspect_image(self.worker['image'])
+        except Exception:
+            logging.exception('Background pull of %s failed',
+                              self.worker['image'])
+            return
+        if docker_image.get(u'Id') == self.worker['image_id']:
+            logging.info('Image %s is up to date', self.worker['image'])
+            return
+        logging.info('Image %s updated to %s', self.worker['image'],
+                     docker_image.get(u'Id'))
+        self.worker['image_id'] = docker_image.get(u'Id')
+        if sorted(_get_exposed_ports(docker_image)) != \
+                sorted(self._image_ports):
+            logging.warning('Updated image %s exposes other ports, restart '
+                            'the worker to apply them', self.worker['image'])
 
     def _get_all_allocated_ports(self):
         """
         get all containers, that have not been stopped, they may have been
         started from outside of the workers scope.
-        :return: array with ports to use, None if not enough ports available
+        :return: -
         """
-        used_ports = set()
-        containers = self.docker.containers()
-        for container in containers:
-            for port in self._get_container_ports(container['Id']):
-                used_ports.add(port)
-        self.port_manager.update_used_ports(used_ports)
+        self.port_manager.update_used_ports(
+            _get_bound_ports(self._get_container_index()))
+
+    def _load_leases(self):
+        """
+        mark the ports leased by the stored instances used, and those of the
+        containers found with one listing, e.g. foreign ones, before the
+        first create comes in
+        :return: -
+        """
+        ports = list()
+        for instance in self.local_persistence.get_instances_by_status(
+                *LEASE_STATUS).values():
+            ports.extend(_get_lease_ports(instance))
+        self.port_manager.update_used_ports(ports)
+        logging.info('Loaded %d leased ports', len(ports))
+        self._get_all_allocated_ports()
+
+    def _reconcile_ports(self, index):
+        """
+        mark the ports held by containers used, and release the ones that
+        neither an instance lease nor a container accounts for any more,
+        e.g. after a crash between acquiring ports and storing the instance,
+        or of foreign containers that are gone. Ports claimed by more than
+        one owner are logged and kept.
+        :param index: container index
+        :return: -
+        """
+        bound = _get_bound_ports(index)
+        leases = dict(
+            (instance_id, instance['lease']) for instance_id, instance in
+            self.local_persistence.get_instances_by_status(
+                *LEASE_STATUS).items()
+            if 'lease' in instance)
+        self.port_manager.update_used_ports(bound.keys())
+        leaked, conflicts = self._lease_checker.diff(
+            self.port_manager.used_ports, leases, bound)
+        if leaked:
+            logging.warning('Reclaiming leaked ports %s', leaked)
+            self.port_manager.release_ports(leaked)
+        for conflict in conflicts:
+            logging.error('Port %s claimed by %s', conflict['port'],
+                          ', '.join(conflict['owners']))
+
+    def _get_container_index(self):
+        """
+        list all containers with a single docker call and index them by Id,
+        so a tick does not need to inspect every container on its own
+        :return: dict, container id -> dict with running, networking and the
+        ports reserved by a container that was created but not yet started
+        """
+        index = dict()
+        for container in self.docker.containers(all=True):
+            index[container['Id']] = {
+                'running': _is_listed_running(container),
+                'networking': self._get_listed_networking(container),
+                'reserved': _get_reserved_ports(container)}
+        return index
+
+    def _get_listed_networking(self, container):
+        """
+        translate the Ports of a container listing into the Ports section
+        format of an inspected container
+        :param container: dict, one entry of the container listing
+        :return: dict with the published ports of the container
+        """
+        networking = dict()
+        for port in container.get('Ports') or []:
+            if 'PublicPort' not in port:
+                continue
+            if 'ip' in self.config['worker'].keys():
+                host_ip = unicode(self.config['worker']['ip'])
+            else:
+                host_ip = port.get('IP', u'0.0.0.0')
+            key = u'{}/{}'.format(port['PrivatePort'], port['Type'])
+            networking.setdefault(key, []).append(
+                {u'HostIp': host_ip, u'HostPort': unicode(port['PublicPort'])})
+        return networking
 
     def _get_container(self, container_id):
         """
@@ -140,84 +472,324 @@ class DockerWorker(Worker):
         :param container_id: id of the container
         :return: list of integers
         """
-        networking = self._get_container_networking(container_id)
-        ports = list()
-        if networking:
-            for port in networking.keys():
-                for index, unused in enumerate(networking[port]):
-                    ports.append(int(networking[port][index][u'HostPort']))
-        return ports
+        return _get_ports(self._get_container_networking(container_id))
 
-    def _publish_updates(self):
-        instances = self.local_persistence.get_instances()
-        for instance_id in instances.keys():
-            if instances[instance_id]['status'] is INSTANCE_STATUS.DELETED:
-                continue
-            elif instances[instance_id]['status'] is INSTANCE_STATUS.FAILED:
-                self.local_persistence.publish_instance(instance_id)
-                continue
+    def _start_background(self):
+        super(DockerWorker, self)._start_background()
+        if self._events and self.primary:
+            thread = threading.Thread(target=self._watch_events,
+                                      name='docker-events')
+            thread.daemon = True
+            thread.start()
+        if self._pull_in_background:
+            thread = threading.Thread(target=self._refresh_image,
+                                      name='image-pull')
+            thread.daemon = True
+            thread.start()
+        if self._prober:
+            thread = threading.Thread(target=self._prober.run,
+                                      args=(lambda: self.running,),
+                                      name='readiness-probe')
+            thread.daemon = True
+            thread.start()
+        if self._warm_pool:
+            thread = threading.Thread(target=self._warm_pool.run,
+                                      args=(lambda: self.running,),
+                                      name='warm-pool')
+            thread.daemon = True
+            thread.start()
 
-            container_id = instances[instance_id]['container_id']
-            container = self._get_container(container_id)
-            if not container_id or not container or not _is_running(container):
-                instances[instance_id].pop('connection', None)
-                instances[instance_id].pop('urls', None)
-                self.local_persistence.update_instance_status(
-                    instances[instance_id],
-                    INSTANCE_STATUS.STOPPED)
-                continue
-            elif _is_running(container):
-                self._set_networking(instances[instance_id])
+    def _watch_events(self):
+        """
+        follow the docker event stream and apply container state changes to
+        the instances as soon as they happen. The stream is resumed from the
+        last seen event after a disconnect, so no transitions get lost.
+        :return: -
+        """
+        since = None
+        while self.running:
+            try:
+                for event in self.docker.events(
+                        since=since,
+                        filters={'event': list(CONTAINER_EVENTS)},
+                        decode=True):
+                    since = event.get('time', since)
+                    self._handle_container_event(event)
+                    if not self.running:
+                        break
+            except Exception as err:
+                logging.info('Docker event stream interrupted: %s', err)
+                time.sleep(1)
+
+    def _handle_container_event(self, event):
+        """
+        update the instance belonging to the container of a docker event
+        :param event: dict, decoded docker event
+        :return: -
+        """
+        status = event.get('status')
+        if status not in CONTAINER_EVENTS:
+            return
+        instance_id = self._containers.get(event.get('id'))
+        if instance_id is None:
+            return
+        logging.debug('Container event %s for instance %s',
+                      status, instance_id)
+        with self.instance_lock(instance_id):
+            instance = self.local_persistence.get_instance(instance_id)
+            if instance is None or instance['status'] in \
+                    (INSTANCE_STATUS.DELETED, INSTANCE_STATUS.FAILED):
+                return
+            running = False
+            if status in ('start', 'kill'):
+                # a kill may only have sent a signal the container survives
+                container = self._get_container(instance['container_id'])
+                running = bool(container) and _is_running(container)
+            if status == 'start':
+                if running:
+                    self._set_running(instance)
+            elif not running:
+                instance.pop('connection', None)
+                instance.pop('urls', None)
                 self.local_persistence.update_instance_status(
-                    instances[instance_id],
-                    INSTANCE_STATUS.RUNNING)
-            else:
-                logging.error("error while publishing updates")
-        self._get_all_allocated_ports()
+                    instance, INSTANCE_STATUS.STOPPED)
+
+    def _publish_updates(self):
+        try:
+            index = self._get_container_index()
+        except (docker.errors.DockerException,
+                requests.exceptions.RequestException):
+            logging.exception('Not able to list containers')
+            self._update_worker_status()
+            return
+        with self.local_persistence.batch():
+            self._reconcile_instances(index)
+        self.port_manager.update_used_ports(_get_bound_ports(index))
+        self._update_worker_status()
+
+    def _resync_ports(self):
+        self._reconcile_ports(self._get_container_index())
         self._update_worker_status()
 
+    def _reconcile_instances(self, index):
+        """
+        derive the state of every instance from the container index. With
+        the event stream enabled this runs every 60 seconds by default, as a
+        safety net for missed events.
+        :param index: container index of the current tick
+        :return: -
+        """
+        for instance_id in self.local_persistence.get_instance_ids(
+                INSTANCE_STATUS.STARTING, INSTANCE_STATUS.RUNNING,
+                INSTANCE_STATUS.STOPPED):
+            with self.instance_lock(instance_id):
+                self._reconcile_instance(instance_id, index)
+        for instance_id in self.local_persistence.get_instance_ids(
+                INSTANCE_STATUS.FAILED):
+            self.local_persistence.republish_failed(instance_id)
+
+    def _reconcile_instance(self, instance_id, index):
+        instance = self.local_persistence.get_instance(instance_id)
+        if instance is None or instance['status'] == INSTANCE_STATUS.DELETED:
+            return
+        elif instance['status'] == INSTANCE_STATUS.FAILED:
+            self.local_persistence.republish_failed(instance['id'])
+            return
+
+        container_id = instance['container_id']
+        if container_id:
+            self._containers[container_id] = instance['id']
+        container = index.get(container_id)
+        if not container_id or not container or not container['running']:
+            instance.pop('connection', None)
+            instance.pop('urls', None)
+            self.local_persistence.update_instance_status(
+                instance,
+                INSTANCE_STATUS.STOPPED)
+        elif container['running']:
+            self._set_running(instance, container['networking'])
+        else:
+            logging.error("error while publishing updates")
+
+    def _set_running(self, instance, networking=None):
+        """
+        mark the instance of a running container RUNNING, or, while its
+        readiness probe has not succeeded yet, keep it STARTING
+        :param instance: dict, the instance
+        :param networking: dict, Ports section of the container, inspected
+        if None
+        :return: -
+        """
+        self._set_networking(instance, networking)
+        if self._prober and instance['status'] == INSTANCE_STATUS.STARTING:
+            self.local_persistence.update_instance_status(
+                instance, INSTANCE_STATUS.STARTING)
+            if not self._prober.is_probing(instance['id']):
+                self._start_probe(instance)
+            return
+        self.local_persistence.update_instance_status(
+            instance, INSTANCE_STATUS.RUNNING)
+
+    def _start_probe(self, instance):
+        targets = [(self._probe_host, port)
+                   for port in _get_ports(instance.get('connection'))]
+        if not targets:
+            self._probe_finished(instance['id'], True)
+            return
+        self._prober.probe(instance['id'], targets, self._probe_finished)
+
+    def _probe_finished(self, instance_id, ready):
+        """
+        move the instance to RUNNING as soon as the probe is done. After a
+        timeout it gets there as well, docker says the container runs.
+        """
+        with self.instance_lock(instance_id):
+            instance = self.local_persistence.get_instance(instance_id)
+            if instance is None or \
+                    instance['status'] != INSTANCE_STATUS.STARTING:
+                return
+            if not ready:
+                logging.warning('Instance %s not ready after %ss',
+                                instance_id, self._prober.timeout)
+            self.local_persistence.update_instance_status(
+                instance, INSTANCE_STATUS.RUNNING)
+
+    def _add_jobs(self):
+        super(DockerWorker, self)._add_jobs()
+        if self._sampler:
+            self.scheduler.add('resource_sample', self._sample_resources,
+                               self.sample_interval)
+
+    def _sample_resources(self):
+        self._sampler.sample()
+        self._update_worker_status()
+
+    def _get_running_containers(self):
+        return [instance['container_id'] for instance in
+                self.local_persistence.get_instances_by_status(
+                    INSTANCE_STATUS.RUNNING).values()
+                if instance.get('container_id')]
+
     def _update_worker_status(self):
+        if self._warm_pool:
+            self.worker['warm_pool'] = self._warm_pool.stats()
+        if self._sampler:
+            self.worker['capacity'] = {
+                'score': self._sampler.score(),
+                'cpu_headroom': self._sampler.cpu_headroom,
+                'memory_headroom': self._sampler.memory_headroom,
+                'slots': self.admission.free_slots()}
+        super(DockerWorker, self)._update_worker_status()
+
+    def _capacity(self):
+        if self.docker.breaker.open:
+            return 0
+        if self._sampler and not self._sampler.has_headroom():
+            return 0
         number_required_ports = len(self._image_ports)
-        if self.port_manager.enough_ports_left(number_required_ports):
-            self.worker['available'] = True
-            self.worker['status'] = 'Worker available'
-        else:
-            self.worker['available'] = False
-            self.worker['status'] = 'Worker unavailable, ' \
-                                    'to many resources in use'
+        if not number_required_ports:
+            return None
+        capacity = self.port_manager.free_count // number_required_ports
+        if self._warm_pool:
+            capacity += self._warm_pool.ready
+        return capacity
 
-    def _set_networking(self, instance):
-        instance['connection'] = \
-            self._get_container_networking(instance['container_id'])
+    def _set_networking(self, instance, networking=None):
+        if networking is None:
+            networking = \
+                self._get_container_networking(instance['container_id'])
+        instance['connection'] = networking
         instance['urls'] = self.url_builder.build(instance['connection'])
 
 
-def _check_instance_env_port_injection(environment=[], ports=[]):
-    count = 0
-    for index, item in enumerate(environment):
-        if 'INJECT_PORT' in item and len(ports) > 0:
-            if count < len(ports):
-                port = ports[count]
-            else:
-                port = ports[0]
-            environment[index] = item.replace('INJECT_PORT', str(port))
-            count += 1
-    return environment
+def _get_ports(networking):
+    """
+    return a list of the concrete host ports of a Ports section
+    :param networking: dict with the Ports section of a container
+    :return: list of integers
+    """
+    ports = list()
+    if networking:
+        for port in networking.keys():
+            for index, unused in enumerate(networking[port]):
+                ports.append(int(networking[port][index][u'HostPort']))
+    return ports
+
+
+def _get_pool_size(worker_conf, batch_threads):
+    """
+    :return: number of connections to the docker daemon, one for every
+    thread that may call it at the same time: the dispatch threads, the
+    threads of a batch, the resource sampler, and four for the scheduler,
+    the event stream, the image pull and the warm pool
+    """
+    size = int(worker_conf.get('dispatch_threads', 0)) + batch_threads + 4
+    if worker_conf.get('resource_sampling') == 'True':
+        size += int(worker_conf.get('sampler_threads', 4))
+    return size
+
+
+def _get_bound_ports(index):
+    """
+    :param index: container index
+    :return: dict, port -> id of the container that publishes or reserves it
+    """
+    bound = dict()
+    for container_id, container in index.items():
+        ports = container['reserved']
+        if container['running']:
+            ports = ports + _get_ports(container['networking'])
+        for port in ports:
+            bound[port] = container_id
+    return bound
+
+
+def _get_lease_ports(instance):
+    return instance.get('lease', {}).get('ports', [])
+
+
+def _get_reserved_ports(container):
+    """
+    :param container: dict, a container of the container listing
+    :return: list of the ports in the label of a container that was created
+    but never started, as the ones waiting in the warm pool
+    """
+    if not _is_listed_created(container):
+        return []
+    return _get_label_ports(container)
+
+
+def _get_label_ports(container):
+    """
+    :param container: dict, a container of the container listing
+    :return: list of the ports in the ports label of the container
+    """
+    label = (container.get('Labels') or {}).get(PORTS_LABEL)
+    if not label:
+        return []
+    return [int(port) for port in label.split(',')]
+
+
+def _get_exposed_ports(docker_image):
+    ports = []
+    for port in docker_image[u'ContainerConfig'][u'ExposedPorts'].keys():
+        ports.append(port.split('/')[0])
+    return ports
+
+
+def _is_listed_running(container):
+    if 'State' in container:
+        return container['State'] == 'running'
+    return container.get('Status', '').startswith('Up')
+
+
+def _is_listed_created(container):
+    if 'State' in container:
+        return container['State'] == 'created'
+    return container.get('Status', '').startswith('Created')
 
 
 def _is_running(container):
     if 'State' not in container or 'Running' not in container['State']:
         return False
     return container['State']['Running']
-
-
-def _get_tls(config):
-    keys = config.keys()
-    if 'client_cert' in keys and 'client_key' in keys \
-            and 'tls_verify' in keys:
-        if config['tls_verify'] == 'True':
-            verify = True
-        else:
-            verify = False
-        return TLSConfig(client_cert=(
-            config['client_cert'], config['client_key'],), verify=verify)
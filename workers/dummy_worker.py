@@ -28,6 +28,7 @@ class DummyWorker(Worker):
         logging.info('Deleting instance id: %s', instance_id)
         instance = self.local_persistence.get_instance(instance_id)
         if instance is None:
+            self._mark_unknown_deleted(instance_id)
             return
         self.local_persistence.update_instance_status(
             instance, INSTANCE_STATUS.DELETED)
@@ -37,8 +38,14 @@ class DummyWorker(Worker):
         dummy instances always change state from STARTING to RUNNING
         :return:
         """
-        instances = self.local_persistence.get_instances()
-        for instance_name in instances.keys():
-            if instances[instance_name]['status'] == INSTANCE_STATUS.STARTING:
-                self.local_persistence.update_instance_status(
-                    instances[instance_name], INSTANCE_STATUS.RUNNING)
+        instance_ids = self.local_persistence.get_instance_ids(
+            INSTANCE_STATUS.STARTING)
+        with self.local_persistence.batch():
+            for instance_name in instance_ids:
+                with self.instance_lock(instance_name):
+                    instance = self.local_persistence.get_instance(
+                        instance_name)
+                    if instance is not None and \
+                            instance['status'] == INSTANCE_STATUS.STARTING:
+                        self.local_persistence.update_instance_status(
+                            instance, INSTANCE_STATUS.RUNNING)
@@ -0,0 +1,76 @@
+import os
+import string
+
+ALPHABET = string.ascii_letters + string.digits
+# bytes at or above this would make some characters more likely
+_ACCEPTED_BYTES = 256 - 256 % len(ALPHABET)
+PORT_PLACEHOLDER = 'INJECT_PORT'
+
+
+def get_random_keys(count, length=16):
+    """
+    generate secrets from a single read of os.urandom in most cases, bytes
+    that would bias the alphabet are skipped
+    :param count: number of secrets
+    :param length: characters per secret
+    :return: list of strings
+    """
+    needed = count * length
+    characters = list()
+    while len(characters) < needed:
+        missing = needed - len(characters)
+        for byte in bytearray(os.urandom(missing + missing // 4 + 8)):
+            if byte < _ACCEPTED_BYTES:
+                characters.append(ALPHABET[byte % len(ALPHABET)])
+    return [''.join(characters[start:start + length])
+            for start in range(0, needed, length)]
+
+
+class EnvironmentTemplate(object):
+    """
+    the [instance_environment] section compiled once: entries with an
+    empty value get a fresh secret per instance, entries containing
+    INJECT_PORT get one of the host ports of the instance, in order, the
+    first one again once the ports run out
+    """
+
+    def __init__(self, environment, secret_length=16):
+        """
+        :param environment: dict, variable name -> value
+        :param secret_length: characters of a generated secret
+        :return: -
+        """
+        self.secret_length = secret_length
+        self._entries = list()
+        self._secrets = 0
+        port_slot = 0
+        for key in environment.keys():
+            value = environment[key]
+            if value == '':
+                self._entries.append((key + '=', None, self._secrets))
+                self._secrets += 1
+            elif PORT_PLACEHOLDER in value:
+                self._entries.append(
+                    (key + '=', value.split(PORT_PLACEHOLDER), port_slot))
+                port_slot += 1
+            else:
+                self._entries.append((key + '=' + value, None, None))
+
+    def render(self, ports=()):
+        """
+        :param ports: host ports of the instance
+        :return: list of key=value strings
+        """
+        secrets = get_random_keys(self._secrets, self.secret_length)
+        environment = list()
+        for prefix, parts, slot in self._entries:
+            if slot is None:
+                environment.append(prefix)
+            elif parts is None:
+                environment.append(prefix + secrets[slot])
+            elif ports:
+                port = str(ports[slot] if slot < len(ports) else ports[0])
+                environment.append(prefix + port.join(parts))
+            else:
+                environment.append(prefix + PORT_PLACEHOLDER.join(parts))
+        return environment
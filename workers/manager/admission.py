@@ -0,0 +1,102 @@
+import logging
+import threading
+
+from workers.metrics import REGISTRY
+
+REJECTED = REGISTRY.counter(
+    'worker_creates_rejected_total', 'Creates rejected by admission control')
+
+
+class AdmissionController(object):
+    """
+    decides before any work starts whether another create fits, bounded by
+    the number of creates in flight and by the free capacity of the worker.
+    A create counts against the capacity until it holds its resources, e.g.
+    has acquired its ports, from then on the capacity itself excludes them.
+    """
+
+    def __init__(self, max_in_flight, capacity):
+        """
+        :param max_in_flight: number of concurrent creates, 0 for no limit
+        :param capacity: function returning the number of instances the
+        resources have room for, None for no limit
+        :return: -
+        """
+        self.max_in_flight = max_in_flight
+        self._capacity = capacity
+        self.in_flight = 0
+        # admitted creates that hold no resources yet
+        self.pending = 0
+        self._lock = threading.Condition()
+        self._local = threading.local()
+
+    def free_slots(self):
+        """
+        :return: number of creates that would be admitted right now, None
+        for no limit
+        """
+        slots = self._get_capacity_slots()
+        if self.max_in_flight:
+            bounded = self.max_in_flight - self.in_flight
+            if slots is None or bounded < slots:
+                slots = bounded
+        if slots is None:
+            return None
+        return max(slots, 0)
+
+    def has_capacity(self):
+        slots = self.free_slots()
+        return slots is None or slots > 0
+
+    def admit(self, wait=False):
+        """
+        reserve a slot for a create
+        :param wait: bool, wait for a create to finish when max_in_flight
+        are going on, instead of rejecting; only a lack of capacity rejects
+        :return: bool, False if the create has to be rejected
+        """
+        with self._lock:
+            while wait and self._is_bounded():
+                slots = self._get_capacity_slots()
+                if slots is not None and slots <= 0:
+                    break
+                self._lock.wait()
+            if not self.has_capacity():
+                logging.warning('Rejecting create, %d in flight',
+                                self.in_flight)
+                REJECTED.inc()
+                return False
+            self.in_flight += 1
+            self.pending += 1
+            self._local.pending = True
+            return True
+
+    def acquired(self):
+        """
+        tell that the create admitted on this thread holds its resources
+        now and no longer needs to be counted against the capacity
+        :return: -
+        """
+        with self._lock:
+            self._settle()
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._settle()
+            self._lock.notify_all()
+
+    def _get_capacity_slots(self):
+        slots = self._capacity()
+        if slots is not None:
+            slots -= self.pending
+        return slots
+
+    def _is_bounded(self):
+        return bool(self.max_in_flight) and \
+            self.in_flight >= self.max_in_flight
+
+    def _settle(self):
+        if getattr(self._local, 'pending', False):
+            self.pending -= 1
+            self._local.pending = False
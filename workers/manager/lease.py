@@ -0,0 +1,77 @@
+import time
+
+from workers.metrics import REGISTRY
+
+RECLAIMED = REGISTRY.counter(
+    'worker_ports_reclaimed_total',
+    'Ports marked used that no instance or container held')
+CONFLICTS = REGISTRY.gauge(
+    'worker_port_conflicts', 'Ports held by more than one owner')
+
+
+def get_lease(ports, container_id):
+    """
+    :param ports: list of host ports
+    :param container_id: id of the container the ports are bound to
+    :return: dict, the lease stored with the instance owning the ports
+    """
+    return {'ports': list(ports), 'container_id': container_id,
+            'ts': time.time()}
+
+
+class LeaseChecker(object):
+    """
+    compares the ports the port manager marks used with the ones actually
+    held: leased by an instance, or bound or labelled by a container. A port
+    nobody holds is only reported as leaked after the grace time, so ports
+    acquired for a container that is still being created are left alone.
+    """
+
+    def __init__(self, grace=60):
+        """
+        :param grace: seconds a port may be unaccounted for
+        :return: -
+        """
+        self.grace = grace
+        self._unaccounted = dict()
+
+    def diff(self, used, leases, bound, now=None):
+        """
+        :param used: set of the ports marked used
+        :param leases: dict, instance id -> lease
+        :param bound: dict, port -> id of the container holding it
+        :param now: timestamp of the check, the current time if None
+        :return: tuple of the list of leaked ports and the list of conflicts,
+        dicts with the port and its owners
+        """
+        now = now or time.time()
+        leased = dict()
+        conflicts = dict()
+        for instance_id, lease in sorted(leases.items()):
+            for port in lease['ports']:
+                if port in leased:
+                    conflicts.setdefault(port, [leased[port]]).append(
+                        instance_id)
+                else:
+                    leased[port] = instance_id
+        for port, container_id in bound.items():
+            instance_id = leased.get(port)
+            if instance_id is not None and \
+                    leases[instance_id]['container_id'] != container_id:
+                conflicts.setdefault(port, [instance_id]).append(
+                    container_id)
+
+        unaccounted = set(used) - set(leased) - set(bound)
+        for port in list(self._unaccounted):
+            if port not in unaccounted:
+                del self._unaccounted[port]
+        leaked = list()
+        for port in unaccounted:
+            first_seen = self._unaccounted.setdefault(port, now)
+            if now - first_seen >= self.grace:
+                leaked.append(port)
+                del self._unaccounted[port]
+        RECLAIMED.inc(len(leaked))
+        CONFLICTS.set(len(conflicts))
+        return sorted(leaked), [{'port': port, 'owners': owners}
+                                for port, owners in sorted(conflicts.items())]
@@ -1,12 +1,31 @@
+import hashlib
+import json
 import logging
+import threading
 import time
 
-from collections import namedtuple
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+
+from workers.metrics import REGISTRY
 
 States = namedtuple('States', ['STARTING', 'DELETED', 'RUNNING', 'STOPPED',
                                'FAILED'])
 INSTANCE_STATUS = States('starting', 'deleted', 'running', 'stopped', 'failed')
 
+WRITES = REGISTRY.counter(
+    'worker_instance_writes_total', 'Instance writes to the store')
+SKIPPED = REGISTRY.counter(
+    'worker_instance_updates_skipped_total',
+    'Instance updates skipped because nothing changed')
+PUBLISHED = REGISTRY.counter(
+    'worker_instance_publishes_total', 'Instance messages by subject')
+COMPACTED = REGISTRY.counter(
+    'worker_instances_compacted_total',
+    'Deleted and failed instances removed after their retention time')
+
+TERMINAL_STATUS = (INSTANCE_STATUS.DELETED, INSTANCE_STATUS.FAILED)
+
 
 class PersistenceManager(object):
     """
@@ -24,21 +43,133 @@ class PersistenceManager(object):
         backend_store_class = backend
         self.instances = backend_store_class(config=config)
         self.publish = publish
+        self.snapshot_interval = float(config.get('snapshot_interval', 300))
+        self.write_behind = config.get('write_behind') == 'True'
+        self.retention = float(config.get('retention_ttl', 0))
+        self.failed_republish_limit = int(
+            config.get('failed_republish_limit', 3))
+        if 'archive_collection' in config:
+            archive_config = dict(config)
+            archive_config['collection'] = config['archive_collection']
+            self.archive = backend_store_class(config=archive_config)
+        else:
+            self.archive = None
+        self._republished = dict()
+        self._last_snapshot = 0
+        self._digests = dict()
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._by_status = defaultdict(set)
+        if config.get('cache', 'True') == 'True':
+            self._cache = dict(self.instances.get_all())
+            for instance_id, instance in self._cache.items():
+                self._digests[instance_id] = _get_digest(instance)
+                self._by_status[instance.get('status')].add(instance_id)
+        else:
+            self._cache = None
         logging.info('Instances stored: %r', self.get_instances().keys())
 
     def get_instance(self, instance_id):
-        return self.instances.get(instance_id)
+        if self._cache is None:
+            return self.instances.get(instance_id)
+        with self._lock:
+            instance = self._cache.get(instance_id)
+        if instance is not None:
+            return dict(instance)
 
     def get_instances(self):
-        return self.instances.get_all()
+        if self._cache is None:
+            return self.instances.get_all()
+        with self._lock:
+            return dict((instance_id, dict(instance))
+                        for instance_id, instance in self._cache.items())
+
+    def get_instance_ids(self, *statuses):
+        """
+        :param statuses: one or more of INSTANCE_STATUS
+        :return: list of the ids of the instances in one of the statuses,
+        looked up in the status index when the cache is enabled
+        """
+        if self._cache is None:
+            return [instance_id for instance_id, instance
+                    in self.instances.get_all().items()
+                    if instance.get('status') in statuses]
+        with self._lock:
+            return [instance_id for status in statuses
+                    for instance_id in self._by_status.get(status, ())]
+
+    def get_instances_by_status(self, *statuses):
+        """
+        :param statuses: one or more of INSTANCE_STATUS
+        :return: dict, instance id -> instance, of the instances in one of
+        the statuses
+        """
+        instances = dict()
+        for instance_id in self.get_instance_ids(*statuses):
+            instance = self.get_instance(instance_id)
+            if instance is not None:
+                instances[instance_id] = instance
+        return instances
 
     def set_instance(self, instance_id, instance):
+        """
+        store the instance in the cache and, unless writing behind or in a
+        batch, in the backend
+        :param instance_id: id of the instance
+        :param instance: dict, the instance
+        :return: -
+        """
         instance['ts'] = time.time()
+        if self._cache is not None:
+            with self._lock:
+                previous = self._cache.get(instance_id)
+                if previous is not None:
+                    self._by_status[previous.get('status')].discard(
+                        instance_id)
+                self._by_status[instance.get('status')].add(instance_id)
+                self._cache[instance_id] = dict(instance)
+                if self.write_behind or \
+                        getattr(self._local, 'pending', None) is not None:
+                    self._dirty.add(instance_id)
+                    return
         self.instances.update(instance_id, instance)
+        WRITES.inc()
+
+    def flush(self):
+        """
+        write the instances changed since the last flush to the backend
+        :return: -
+        """
+        with self._lock:
+            dirty = [(instance_id, dict(self._cache[instance_id]))
+                     for instance_id in self._dirty]
+            self._dirty.clear()
+        for instance_id, instance in dirty:
+            self.instances.update(instance_id, instance)
+            WRITES.inc()
+        if dirty:
+            logging.debug('Flushed %d instances', len(dirty))
 
     def update_instance_status(self, instance, status, publish=True):
+        """
+        store and publish the instance, unless its content is the same as
+        at the last update. Without the cache other processes may have
+        changed the instance in between, so it is always stored.
+        :param instance: dict, the instance
+        :param status: one of INSTANCE_STATUS
+        :param publish: bool, send the instance to the messaging system
+        :return: -
+        """
         instance['status'] = status
+        digest = _get_digest(instance)
+        if self._cache is not None and \
+                self._digests.get(instance['id']) == digest:
+            SKIPPED.inc()
+            return
         self.set_instance(instance['id'], instance)
+        self._digests[instance['id']] = digest
+        self._republished.pop(instance['id'], None)
         if publish:
             self.publish_instance(instance['id'])
 
@@ -49,5 +180,128 @@ class PersistenceManager(object):
         :return: -
         """
         instance = self.get_instance(instance_id)
-        if instance is not None:
+        if instance is None:
+            return
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending[instance_id] = instance
+        else:
             self.publish('info', 'instance_info', {'instance': instance})
+            PUBLISHED.inc(subject='instance_info')
+
+    def republish_failed(self, instance_id):
+        """
+        publish a failed instance again, so a consumer that missed it learns
+        about it, but only failed_republish_limit times
+        :param instance_id: id of the failed instance
+        :return: -
+        """
+        count = self._republished.get(instance_id, 0)
+        if count >= self.failed_republish_limit:
+            return
+        self._republished[instance_id] = count + 1
+        self.publish_instance(instance_id)
+
+    def compact(self):
+        """
+        remove deleted and failed instances last stored more than
+        retention_ttl seconds ago. They are moved to the archive_collection
+        if one is configured and dropped otherwise. Stores without a delete
+        keep them, but they still leave the cache and so every later tick.
+        :return: number of instances removed
+        """
+        if not self.retention:
+            return 0
+        expired = time.time() - self.retention
+        instances = self.get_instances()
+        removed = [instance_id for instance_id, instance in instances.items()
+                   if instance.get('status') in TERMINAL_STATUS and
+                   instance.get('ts', 0) < expired]
+        delete = getattr(self.instances, 'delete', None)
+        for instance_id in removed:
+            if self.archive is not None:
+                self.archive.update(instance_id, instances[instance_id])
+            if delete is not None:
+                delete(instance_id)
+            with self._lock:
+                if self._cache is not None:
+                    self._cache.pop(instance_id, None)
+                    self._by_status[
+                        instances[instance_id].get('status')].discard(
+                            instance_id)
+                self._dirty.discard(instance_id)
+            self._digests.pop(instance_id, None)
+            self._republished.pop(instance_id, None)
+        if removed:
+            logging.info('Compacted %d instances', len(removed))
+            COMPACTED.inc(len(removed))
+        return len(removed)
+
+    @contextmanager
+    def batch(self):
+        """
+        collect the instances published by the current thread and send them
+        as one instance_info_batch message when the block ends. Once every
+        snapshot_interval seconds the message carries all instances that are
+        not deleted, so consumers that joined late catch up. With the cache
+        enabled, the writes of the block are held back and flushed at its
+        end as well, so an instance changed twice is written once. A batch
+        opened inside another one joins the outer batch.
+        :return: dict of the instances collected so far, to be handed to
+        collect in other threads taking part in the batch
+        """
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            yield pending
+            return
+        pending = self._local.pending = dict()
+        try:
+            yield pending
+        finally:
+            self._local.pending = None
+            self._publish_batch(pending)
+            self.flush()
+
+    @contextmanager
+    def collect(self, pending):
+        """
+        let the current thread take part in a batch opened by another one
+        :param pending: dict yielded by batch
+        :return: -
+        """
+        self._local.pending = pending
+        try:
+            yield
+        finally:
+            self._local.pending = None
+
+    def _publish_batch(self, pending):
+        now = time.time()
+        snapshot = now - self._last_snapshot >= self.snapshot_interval
+        if snapshot:
+            self._last_snapshot = now
+            instances = self.get_instances()
+            snapshot_instances = dict(
+                (instance_id, instances[instance_id])
+                for instance_id in instances.keys()
+                if instances[instance_id]['status'] != INSTANCE_STATUS.DELETED)
+            snapshot_instances.update(pending)
+            pending = snapshot_instances
+        if pending or snapshot:
+            self.publish('info', 'instance_info_batch',
+                         {'instances': list(pending.values()),
+                          'snapshot': snapshot})
+            PUBLISHED.inc(subject='instance_info_batch')
+
+
+def _get_digest(instance):
+    """
+    hash the content of an instance, ignoring the time it was last stored
+    :param instance: dict, the instance
+    :return: string
+    """
+    content = dict(instance)
+    content.pop('ts', None)
+    return hashlib.sha1(
+        json.dumps(content, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
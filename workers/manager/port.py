@@ -1,51 +1,207 @@
+import fcntl
 import logging
+import mmap
+import os
+import threading
 
+from contextlib import contextmanager
+
+
+class PortManager(object):
+    """
+    keeps track of the host ports of the configured range in a bitmap with
+    one byte per port, so acquiring, releasing and counting free ports does
+    not depend on the width of the range
+    """
 
-class PortManager():
     def __init__(self, worker_conf):
-        self.port_range = set()
+        self.first_port = 0
+        self._bitmap = bytearray()
         if 'ports' in worker_conf and ':' in worker_conf['ports']:
             start, end = worker_conf['ports'].split(':')
             try:
                 start = int(start)
                 end = int(end)
                 if start <= end:
-                    for item in range(start, end+1):
-                        self.port_range.add(item)
+                    self.first_port = start
+                    self._bitmap = bytearray(end - start + 1)
                 else:
                     logging.error('start port must be smaller then end port')
             except ValueError as err:
                 logging.error('Wrong port configuration given %s', err)
-        self.port_range = frozenset(self.port_range)
-        self.used_ports = set()
+        self.free_count = len(self._bitmap)
+        self._cursor = 0
+        # used ports outside of the configured range, e.g. other containers
+        self._foreign_ports = set()
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return len(self._bitmap)
+
+    @property
+    def used_ports(self):
+        ports = set(self._foreign_ports)
+        for offset, used in enumerate(self._bitmap):
+            if used:
+                ports.add(self.first_port + offset)
+        return ports
 
     def acquire_ports(self, count):
-        available_ports = set(self.port_range.difference(self.used_ports))
-        if count <= len(available_ports):
-            acquired_ports = []
-            for item in range(0, count):
-                port = available_ports.pop()
-                self.used_ports.add(port)
-                acquired_ports.append(port)
-            logging.debug("Acquired ports: %s", acquired_ports)
-            return acquired_ports
-        return None
+        """
+        acquire count ports, preferring a contiguous block next to the last
+        allocation and falling back to single free ports
+        :param count: number of ports needed
+        :return: list of ports, None if not enough ports are left
+        """
+        with self._locked():
+            return self._acquire_ports(count)
 
-    def enough_ports_left(self, count):
-        if count > len(set(self.port_range.difference(self.used_ports))):
-            return False
+    def _acquire_ports(self, count):
+        if count > self.free_count:
+            return None
+        offset = self._find(bytearray(count))
+        if offset >= 0:
+            offsets = range(offset, offset + count)
         else:
-            return True
+            offsets = list()
+            for unused in range(count):
+                offset = self._find(bytearray(1))
+                self._bitmap[offset] = 1
+                self._cursor = offset
+                offsets.append(offset)
+        acquired_ports = list()
+        for offset in offsets:
+            self._bitmap[offset] = 1
+            acquired_ports.append(self.first_port + offset)
+        self.free_count -= count
+        if count:
+            self._cursor = (offsets[-1] + 1) % len(self._bitmap)
+        logging.debug("Acquired ports: %s", acquired_ports)
+        return acquired_ports
+
+    def enough_ports_left(self, count):
+        return count <= self.free_count
 
     def release_ports(self, ports):
         logging.debug('Releasing ports %s', str(ports))
-        for port in ports:
-            try:
-                self.used_ports.remove(port)
-            except KeyError as err:
-                logging.debug('Port %s already released', port, err)
+        with self._locked():
+            for port in ports:
+                offset = self._offset(port)
+                if offset is None:
+                    self._foreign_ports.discard(port)
+                elif self._bitmap[offset]:
+                    self._bitmap[offset] = 0
+                    self.free_count += 1
+                else:
+                    logging.debug('Port %s already released', port)
 
     def update_used_ports(self, ports):
-        for port in ports:
-            self.used_ports.add(port)
-        logging.debug("Used ports: %s", self.used_ports)
+        with self._locked():
+            for port in ports:
+                offset = self._offset(port)
+                if offset is None:
+                    self._foreign_ports.add(port)
+                elif not self._bitmap[offset]:
+                    self._bitmap[offset] = 1
+                    self.free_count -= 1
+        logging.debug("Free ports: %d", self.free_count)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            yield
+
+    def _find(self, block):
+        """
+        next-fit search for a run of free ports, wrapping around at the end
+        of the range
+        :param block: bytearray of zeros with the length of the run
+        :return: offset of the run, -1 if there is none
+        """
+        offset = self._bitmap.find(block, self._cursor)
+        if offset < 0:
+            offset = self._bitmap.find(block, 0, self._cursor + len(block))
+        return offset
+
+    def _offset(self, port):
+        offset = port - self.first_port
+        if 0 <= offset < len(self._bitmap):
+            return offset
+        return None
+
+
+class SharedPortManager(PortManager):
+    """
+    port manager for several worker processes on one host. The bitmap lives
+    in a memory mapped ledger file, every change is made under an exclusive
+    lock of that file, so no two processes hand out the same port.
+    """
+
+    def __init__(self, worker_conf, path):
+        """
+        :param worker_conf: worker part of the config
+        :param path: path of the ledger file, created if missing
+        :return: -
+        """
+        PortManager.__init__(self, worker_conf)
+        self.path = path
+        self._file = open(path, 'a+b')
+        self._map = None
+        if self.size:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._file.fileno()).st_size != self.size:
+                    self._file.truncate(0)
+                    self._file.truncate(self.size)
+                self._map = mmap.mmap(self._file.fileno(), self.size)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._load()
+
+    @property
+    def free_count(self):
+        """
+        free ports as seen by all processes, not only the last change of
+        this one
+        """
+        if getattr(self, '_map', None) is None:
+            return self._free_count
+        return self._map[:].count(bytearray(1))
+
+    @free_count.setter
+    def free_count(self, value):
+        self._free_count = value
+
+    @property
+    def used_ports(self):
+        with self._locked():
+            return PortManager.used_ports.fget(self)
+
+    def reset(self):
+        """
+        mark every port of the ledger free, for a supervisor starting
+        workers that discover the ports in use again
+        :return: -
+        """
+        with self._locked():
+            self._bitmap[:] = bytearray(self.size)
+            self.free_count = self.size
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if self._map is None:
+                yield
+                return
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                self._load()
+                yield
+                self._map[:] = bytes(self._bitmap)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _load(self):
+        self._bitmap[:] = self._map[:]
+        self._free_count = self._bitmap.count(bytearray(1))
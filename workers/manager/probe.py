@@ -0,0 +1,251 @@
+import errno
+import fcntl
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+from workers.metrics import REGISTRY
+
+PROBES = REGISTRY.counter(
+    'worker_readiness_probes_total', 'Finished readiness probes by result')
+PROBE_SECONDS = REGISTRY.histogram(
+    'worker_readiness_probe_seconds', 'Time until an instance was ready')
+
+
+class Probe(object):
+    def __init__(self, key, targets, callback, deadline):
+        self.key = key
+        self.waiting = set(targets)
+        self.callback = callback
+        self.started = time.time()
+        self.deadline = deadline
+        self.due = self.started
+        self.attempts = 0
+
+
+class Prober(object):
+    """
+    checks in a single thread whether services accept connections, by
+    driving non-blocking sockets with poll. A probe is ready once every
+    one of its targets accepted a TCP connection or, in http mode,
+    answered a request with any HTTP status line. Failed targets are tried
+    again every interval until the probe times out.
+    """
+
+    def __init__(self, kind='tcp', path='/', timeout=60, interval=0.5,
+                 connect_timeout=2, max_connections=512):
+        """
+        :param kind: tcp or http
+        :param path: path requested in http mode
+        :param timeout: seconds after which a probe gives up
+        :param interval: seconds between two attempts on a target
+        :param connect_timeout: seconds an attempt may take
+        :param max_connections: sockets open at the same time
+        :return: -
+        """
+        if kind not in ('tcp', 'http'):
+            raise ValueError('Unknown probe type {}'.format(kind))
+        self.kind = kind
+        self.path = path
+        self.timeout = timeout
+        self.interval = interval
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self._probes = dict()
+        self._attempts = dict()
+        self._lock = threading.Lock()
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        fcntl.fcntl(self._wakeup_write, fcntl.F_SETFL, os.O_NONBLOCK)
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._probes)
+
+    def probe(self, key, targets, callback, timeout=None):
+        """
+        start probing, replacing a running probe with the same key
+        :param key: identifies the probe, e.g. the instance id
+        :param targets: list of (host, port) tuples
+        :param callback: function called with key and a bool, True when
+        all targets are ready, False on timeout
+        :param timeout: seconds, the timeout of the prober if None
+        :return: -
+        """
+        deadline = time.time() + (timeout or self.timeout)
+        with self._lock:
+            self._probes[key] = Probe(key, targets, callback, deadline)
+        self._wakeup()
+
+    def is_probing(self, key):
+        with self._lock:
+            return key in self._probes
+
+    def cancel(self, key):
+        with self._lock:
+            self._probes.pop(key, None)
+
+    def run(self, running):
+        """
+        work off the probes as long as running returns True
+        :param running: function without arguments
+        :return: -
+        """
+        while running():
+            try:
+                self._step()
+            except Exception:
+                logging.exception('Error in readiness prober')
+                time.sleep(self.interval)
+
+    def _step(self):
+        now = time.time()
+        finished = self._start_attempts(now)
+        # poll, unlike select, copes with descriptors above FD_SETSIZE
+        poller = select.poll()
+        poller.register(self._wakeup_read, select.POLLIN)
+        sockets = dict()
+        for sock, attempt in self._attempts.items():
+            sockets[sock.fileno()] = sock
+            if attempt['state'] == 'connecting':
+                poller.register(sock, select.POLLOUT)
+            else:
+                poller.register(sock, select.POLLIN)
+        for fd, unused in poller.poll(self._get_wait(now) * 1000):
+            if fd == self._wakeup_read:
+                os.read(self._wakeup_read, 4096)
+                continue
+            sock = sockets[fd]
+            if sock not in self._attempts:
+                continue
+            if self._attempts[sock]['state'] == 'connecting':
+                self._connected(sock)
+            else:
+                self._answered(sock)
+        finished.extend(self._expire(time.time()))
+        for probe, ready in finished:
+            self._finish(probe, ready)
+
+    def _start_attempts(self, now):
+        """
+        open sockets for the targets that are due
+        :return: list of (probe, False) for the probes that timed out
+        """
+        finished = list()
+        busy = set((attempt['key'], attempt['target'])
+                   for attempt in self._attempts.values())
+        with self._lock:
+            probes = list(self._probes.values())
+        for probe in probes:
+            if probe.deadline <= now:
+                finished.append((probe, False))
+                continue
+            if probe.due > now:
+                continue
+            probe.due = now + self.interval
+            probe.attempts += 1
+            for target in list(probe.waiting):
+                if (probe.key, target) in busy:
+                    continue
+                if len(self._attempts) >= self.max_connections:
+                    return finished
+                self._connect(probe, target, now)
+        return finished
+
+    def _connect(self, probe, target, now):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        code = sock.connect_ex(target)
+        if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            return
+        self._attempts[sock] = {'key': probe.key, 'target': target,
+                                'state': 'connecting',
+                                'deadline': now + self.connect_timeout}
+
+    def _connected(self, sock):
+        attempt = self._attempts[sock]
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+            self._close(sock)
+            return
+        if self.kind == 'tcp':
+            self._close(sock)
+            self._target_ready(attempt)
+            return
+        request = 'GET {} HTTP/1.0\r\nHost: {}:{}\r\n\r\n'.format(
+            self.path, attempt['target'][0], attempt['target'][1])
+        try:
+            sock.send(request.encode('ascii'))
+        except socket.error:
+            self._close(sock)
+            return
+        attempt['state'] = 'reading'
+
+    def _answered(self, sock):
+        attempt = self._attempts[sock]
+        try:
+            data = sock.recv(16)
+        except socket.error:
+            data = b''
+        self._close(sock)
+        if data.startswith(b'HTTP/'):
+            self._target_ready(attempt)
+
+    def _target_ready(self, attempt):
+        with self._lock:
+            probe = self._probes.get(attempt['key'])
+        if probe is None:
+            return
+        probe.waiting.discard(attempt['target'])
+        if not probe.waiting:
+            self._finish(probe, True)
+
+    def _expire(self, now):
+        """
+        close attempts that took too long
+        :return: list of (probe, False) for the probes that timed out
+        """
+        for sock, attempt in list(self._attempts.items()):
+            if attempt['deadline'] <= now:
+                self._close(sock)
+        with self._lock:
+            return [(probe, False) for probe in self._probes.values()
+                    if probe.deadline <= now]
+
+    def _finish(self, probe, ready):
+        with self._lock:
+            if self._probes.get(probe.key) is not probe:
+                return
+            del self._probes[probe.key]
+        PROBES.inc(result='ready' if ready else 'timeout')
+        if ready:
+            PROBE_SECONDS.observe(time.time() - probe.started)
+        try:
+            probe.callback(probe.key, ready)
+        except Exception:
+            logging.exception('Error in readiness callback for %s',
+                              probe.key)
+
+    def _get_wait(self, now):
+        deadlines = [attempt['deadline'] for attempt in
+                     self._attempts.values()]
+        with self._lock:
+            for probe in self._probes.values():
+                deadlines.append(probe.deadline)
+                deadlines.append(probe.due)
+        if not deadlines:
+            return self.interval
+        return min(max(min(deadlines) - now, 0.01), self.interval)
+
+    def _close(self, sock):
+        self._attempts.pop(sock, None)
+        sock.close()
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_write, b'x')
+        except OSError:
+            pass
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+
+from workers.metrics import REGISTRY
+from workers.pool import DispatchPool
+
+HEADROOM = REGISTRY.gauge(
+    'worker_resource_headroom', 'Unused share of the host by resource')
+
+
+class ResourceSampler(object):
+    """
+    samples the CPU and memory use of the running containers from the
+    docker stats, a few containers at a time, and keeps the headroom of the
+    host: the share of its CPU time and memory the containers leave unused
+    """
+
+    def __init__(self, docker, containers, threads=4, min_cpu=0.0,
+                 min_memory=0.0):
+        """
+        :param docker: docker client
+        :param containers: function returning the ids of the containers to
+        sample
+        :param threads: number of stats read at the same time
+        :param min_cpu: CPU headroom below which the host counts as full
+        :param min_memory: memory headroom below which the host counts as
+        full
+        :return: -
+        """
+        self._docker = docker
+        self._containers = containers
+        self._pool = DispatchPool(threads, name='resource-sampler')
+        self.min_cpu = min_cpu
+        self.min_memory = min_memory
+        self.cpu_headroom = None
+        self.memory_headroom = None
+        self.sampled_at = None
+        self._memory_total = None
+        self._previous = dict()
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """
+        read the stats of every container once and update the headroom
+        :return: -
+        """
+        container_ids = list(self._containers())
+        samples = dict()
+        for container_id in container_ids:
+            self._pool.submit(self._read, container_id, samples)
+        self._pool.join()
+        if self._memory_total is None:
+            self._memory_total = self._docker.info().get('MemTotal')
+        cpu_used = 0.0
+        memory_used = 0
+        previous = dict()
+        for container_id, stats in samples.items():
+            cpu = stats.get('cpu_stats', {})
+            usage = (cpu.get('cpu_usage', {}).get('total_usage', 0),
+                     cpu.get('system_cpu_usage', 0))
+            previous[container_id] = usage
+            if container_id in self._previous:
+                cpu_used += _get_share(self._previous[container_id], usage)
+            memory_used += stats.get('memory_stats', {}).get('usage', 0)
+        with self._lock:
+            self._previous = previous
+            self.cpu_headroom = max(1.0 - cpu_used, 0.0)
+            if self._memory_total:
+                self.memory_headroom = max(
+                    1.0 - float(memory_used) / self._memory_total, 0.0)
+            self.sampled_at = time.time()
+        HEADROOM.set(self.cpu_headroom, resource='cpu')
+        if self.memory_headroom is not None:
+            HEADROOM.set(self.memory_headroom, resource='memory')
+        logging.debug('Sampled %d containers, headroom cpu %.2f memory %s',
+                      len(samples), self.cpu_headroom, self.memory_headroom)
+
+    def has_headroom(self):
+        """
+        :return: bool, False if CPU or memory headroom is below its minimum,
+        True as long as nothing was sampled
+        """
+        with self._lock:
+            if self.cpu_headroom is not None and \
+                    self.cpu_headroom < self.min_cpu:
+                return False
+            if self.memory_headroom is not None and \
+                    self.memory_headroom < self.min_memory:
+                return False
+            return True
+
+    def score(self):
+        """
+        :return: float between 0 and 1, the smaller of the CPU and memory
+        headroom, None as long as nothing was sampled
+        """
+        with self._lock:
+            known = [headroom for headroom in
+                     (self.cpu_headroom, self.memory_headroom)
+                     if headroom is not None]
+        if not known:
+            return None
+        return round(min(known), 3)
+
+    def _read(self, container_id, samples):
+        stream = self._docker.stats(container_id, decode=True)
+        try:
+            samples[container_id] = next(stream)
+        except Exception as err:
+            logging.debug('No stats for container %s: %s', container_id, err)
+        finally:
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+
+
+def _get_share(previous, current):
+    """
+    :param previous: tuple of container and system CPU time of a sample
+    :param current: the same of the next sample
+    :return: share of the host CPU time the container used in between
+    """
+    system = current[1] - previous[1]
+    if system <= 0:
+        return 0.0
+    return max(float(current[0] - previous[0]) / system, 0.0)
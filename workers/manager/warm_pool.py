@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+
+from collections import deque
+
+
+class WarmPool(object):
+    """
+    keeps up to size items prepared ahead of time, so a request can take a
+    ready one instead of waiting for the slow setup
+    """
+
+    def __init__(self, size, prepare, discard):
+        """
+        :param size: number of items to keep ready
+        :param prepare: function creating an item, returns None if there are
+        no resources left for another one
+        :param discard: function releasing an item that is not used
+        :return: -
+        """
+        self.size = size
+        self._prepare = prepare
+        self._discard = discard
+        self._items = deque()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self._prepared = 0
+        self._prepare_seconds = 0.0
+
+    @property
+    def ready(self):
+        return len(self._items)
+
+    def get(self):
+        """
+        take a prepared item and trigger a refill
+        :return: item, None if the pool is empty
+        """
+        with self._lock:
+            if self._items:
+                self.hits += 1
+                item = self._items.popleft()
+            else:
+                self.misses += 1
+                item = None
+        self._wakeup.set()
+        return item
+
+    def refill(self):
+        """
+        prepare items until the pool is full or resources run out
+        :return: -
+        """
+        while not self._closed and len(self._items) < self.size:
+            started = time.time()
+            try:
+                item = self._prepare()
+            except Exception:
+                logging.exception('Not able to prepare a pool item')
+                return
+            if item is None:
+                return
+            with self._lock:
+                closed = self._closed
+                if not closed:
+                    self._prepared += 1
+                    self._prepare_seconds += time.time() - started
+                    self._items.append(item)
+            if closed:
+                self._discard_item(item)
+
+    def run(self, running, interval=10):
+        """
+        refill the pool whenever an item was taken, and every interval
+        seconds to retry after running out of resources
+        :param running: function telling whether to keep going
+        :param interval: seconds between retries
+        :return: -
+        """
+        while running():
+            self._wakeup.clear()
+            self.refill()
+            self._wakeup.wait(interval)
+
+    def drain(self):
+        """
+        discard all prepared items and stop refilling, an item still being
+        prepared is discarded once it is ready
+        :return: -
+        """
+        with self._lock:
+            self._closed = True
+        self._wakeup.set()
+        while True:
+            with self._lock:
+                if not self._items:
+                    return
+                item = self._items.popleft()
+            self._discard_item(item)
+
+    def _discard_item(self, item):
+        try:
+            self._discard(item)
+        except Exception:
+            logging.exception('Not able to discard a pool item')
+
+    def stats(self):
+        """
+        :return: dict with the fill level, hit rate and the setup time the
+        hits did not have to wait for
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            if self._prepared:
+                average = self._prepare_seconds / self._prepared
+            else:
+                average = 0.0
+            return {'size': self.size,
+                    'ready': len(self._items),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': float(self.hits) / requests if requests else 0,
+                    'saved_seconds': self.hits * average}
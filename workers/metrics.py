@@ -0,0 +1,207 @@
+import bisect
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+
+class Registry(object):
+    """
+    collection of counters, gauges and histograms that can be rendered in
+    the Prometheus text format or summarized for the heartbeat
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = dict()
+
+    def counter(self, name, documentation):
+        return self._get(Counter, name, documentation)
+
+    def gauge(self, name, documentation):
+        return self._get(Gauge, name, documentation)
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, documentation, buckets)
+
+    def render(self):
+        """
+        :return: string in the Prometheus text exposition format
+        """
+        lines = list()
+        for metric in self._get_metrics():
+            lines.append('# HELP {} {}'.format(metric.name,
+                                               metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for suffix, labels, value in metric.samples():
+                lines.append('{}{}{} {}'.format(
+                    metric.name, suffix, _format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        :return: dict with the value of every metric, keyed by name and, for
+        labelled metrics, by the label values
+        """
+        summary = dict()
+        for metric in self._get_metrics():
+            values = metric.summary()
+            if list(values.keys()) == [()]:
+                summary[metric.name] = values[()]
+            else:
+                summary[metric.name] = dict(
+                    (','.join('{}={}'.format(*item) for item in labels), value)
+                    for labels, value in values.items())
+        return summary
+
+    def _get(self, metric_class, name, *args):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, *args)
+            return self._metrics[name]
+
+    def _get_metrics(self):
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = dict()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        return [('', labels, value)
+                for labels, value in self.summary().items()]
+
+    def summary(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation):
+        super(Gauge, self).__init__(name, documentation)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def set_function(self, function):
+        """
+        compute the value when it is read instead of setting it
+        :param function: function without arguments returning the value
+        :return: -
+        """
+        self._function = function
+
+    def summary(self):
+        if self._function is not None:
+            return {(): self._function()}
+        return super(Gauge, self).summary()
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = dict()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            counts = self._values[key]
+            counts[0][index] += 1
+            counts[1] += 1
+            counts[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - started, **labels)
+
+    def samples(self):
+        samples = list()
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, (counts, count, total) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', labels + (('le', bound),),
+                                cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+    def summary(self):
+        with self._lock:
+            return dict((labels, {'count': count, 'sum': round(total, 6)})
+                        for labels, (counts, count, total)
+                        in self._values.items())
+
+
+def serve(registry, port, host='127.0.0.1'):
+    """
+    expose the registry as Prometheus text on http://host:port/metrics in a
+    background thread
+    :return: the HTTP server
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug('Metrics request: ' + format, *args)
+
+    server = HTTPServer((host, int(port)), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    logging.info('Serving metrics on %s:%s', host, port)
+    return server
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, value)
+                          for key, value in labels) + '}'
+
+
+REGISTRY = Registry()
@@ -0,0 +1,136 @@
+import fcntl
+import logging
+import threading
+import zlib
+
+from contextlib import contextmanager
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class DispatchPool(object):
+    """
+    fixed number of threads working off a bounded queue of calls. submit
+    blocks while the queue is full, which holds back the messaging consumer
+    instead of buffering an unbounded amount of work.
+    """
+
+    def __init__(self, size, queue_size=None, name='dispatch'):
+        """
+        :param size: number of threads
+        :param queue_size: number of calls waiting for a thread, size if None
+        :param name: prefix for the thread names
+        :return: -
+        """
+        if queue_size is None:
+            queue_size = size
+        self.size = size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = list()
+        for number in range(size):
+            thread = threading.Thread(target=self._work,
+                                      name='{}-{}'.format(name, number))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, function, *args):
+        self._queue.put((function, args))
+
+    def join(self):
+        """
+        wait until every call submitted so far has finished
+        :return: -
+        """
+        self._queue.join()
+
+    def shutdown(self):
+        """
+        let every thread finish the calls queued so far and then exit
+        :return: -
+        """
+        for unused in self._threads:
+            self._queue.put(None)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            function, args = item
+            try:
+                function(*args)
+            except Exception:
+                logging.exception('Error in %s', function.__name__)
+            finally:
+                self._queue.task_done()
+
+
+class KeyedLock(object):
+    """
+    one reentrant lock per key, dropped again once no thread holds or waits
+    for it
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = dict()
+
+    @contextmanager
+    def __call__(self, key):
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = [threading.RLock(), 0]
+            entry = self._locks[key]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+
+class SharedKeyedLock(KeyedLock):
+    """
+    KeyedLock that also serializes the worker processes sharing one lock
+    file. Keys are hashed onto stripes, each stripe is one byte of the file
+    locked with lockf. Record locks belong to the whole process, so the
+    threads of a process take the stripe in turn and only the outermost
+    holder locks and unlocks the byte.
+    """
+
+    def __init__(self, path, stripes=1024):
+        """
+        :param path: path of the lock file, created if missing
+        :param stripes: number of keys that can be held at the same time
+        without waiting for each other
+        :return: -
+        """
+        KeyedLock.__init__(self)
+        self.path = path
+        self.stripes = stripes
+        self._file = open(path, 'a+b')
+        self._stripe_locks = [threading.RLock() for unused in range(stripes)]
+        self._depths = [0] * stripes
+
+    @contextmanager
+    def __call__(self, key):
+        stripe = (zlib.crc32(str(key)) & 0xffffffff) % self.stripes
+        with KeyedLock.__call__(self, key):
+            with self._stripe_locks[stripe]:
+                if not self._depths[stripe]:
+                    fcntl.lockf(self._file, fcntl.LOCK_EX, 1, stripe)
+                self._depths[stripe] += 1
+                try:
+                    yield
+                finally:
+                    self._depths[stripe] -= 1
+                    if not self._depths[stripe]:
+                        fcntl.lockf(self._file, fcntl.LOCK_UN, 1, stripe)
@@ -0,0 +1,96 @@
+import cProfile
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+
+
+class Profiler(object):
+    """
+    cProfile of the hot paths that can be switched on at runtime for a
+    bounded window. Every outermost wrapped call gets a profile of its own,
+    calls made inside it are profiled with it; when the window ends all
+    profiles are merged and dumped. While switched off a wrapped call costs
+    one attribute check.
+    """
+
+    def __init__(self, directory=None, window=60, name='worker'):
+        """
+        :param directory: where the stats are dumped, the temp dir if None
+        :param window: seconds a profiling run lasts unless stopped before
+        :param name: prefix of the dump files
+        :return: -
+        """
+        self.directory = directory or tempfile.gettempdir()
+        self.window = window
+        self.name = name
+        self.active = False
+        self._profiles = list()
+        self._timer = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def call(self, function, *args, **kwargs):
+        if not self.active or getattr(self._local, 'profiling', False):
+            return function(*args, **kwargs)
+        profiles = self._profiles
+        profile = cProfile.Profile()
+        self._local.profiling = True
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            self._local.profiling = False
+            with self._lock:
+                profiles.append(profile)
+
+    def start(self, window=None):
+        """
+        :param window: seconds to profile, the default window if None
+        :return: bool, False if a run is going on already
+        """
+        with self._lock:
+            if self.active:
+                return False
+            self._profiles = list()
+            self.active = True
+            self._timer = threading.Timer(window or self.window, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        logging.info('Profiling for %ss', window or self.window)
+        return True
+
+    def stop(self):
+        """
+        end the run and dump the merged stats
+        :return: path of the dump, None if nothing was profiled
+        """
+        with self._lock:
+            if not self.active:
+                return None
+            self.active = False
+            self._timer.cancel()
+            profiles, self._profiles = self._profiles, list()
+        if not profiles:
+            logging.info('Profiling stopped, no calls profiled')
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        path = os.path.join(self.directory, '{}-{}-{}.pstats'.format(
+            self.name, os.getpid(), time.strftime('%Y%m%d-%H%M%S')))
+        stats.dump_stats(path)
+        logging.info('Profiled %d calls, stats written to %s',
+                     len(profiles), path)
+        return path
+
+    def toggle(self, signal=None, stack=None):
+        """
+        start a run, or stop the one going on; usable as a signal handler
+        :return: -
+        """
+        if self.active:
+            self.stop()
+        else:
+            self.start()
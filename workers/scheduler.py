@@ -0,0 +1,84 @@
+import logging
+import random
+import threading
+import time
+
+from workers.metrics import REGISTRY
+
+SKIPPED_RUNS = REGISTRY.counter(
+    'worker_scheduler_skipped_total',
+    'Job runs skipped because the previous run was still going')
+
+
+class Job(object):
+    def __init__(self, name, function, interval):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.due = 0
+        self.running = False
+
+
+class Scheduler(object):
+    """
+    runs every job at its own interval in a thread of its own, so a slow job
+    neither delays the others nor piles up runs of itself
+    """
+
+    def __init__(self, jitter=0.1):
+        """
+        :param jitter: fraction of the interval every run is moved by at
+        random, so a fleet of workers does not run in lockstep
+        :return: -
+        """
+        self.jitter = jitter
+        self._jobs = list()
+        self._stopped = threading.Event()
+
+    def add(self, name, function, interval):
+        """
+        :param name: name of the job for logging and metrics
+        :param function: function without arguments
+        :param interval: seconds between the starts of two runs
+        :return: -
+        """
+        self._jobs.append(Job(name, function, float(interval)))
+
+    def run(self):
+        """
+        run the jobs, all of them right away and then whenever they are due,
+        until stop is called
+        :return: -
+        """
+        self._stopped.clear()
+        while not self._stopped.is_set():
+            now = time.time()
+            for job in self._jobs:
+                if job.due <= now:
+                    self._start(job, now)
+            next_due = min([job.due for job in self._jobs] + [now + 1])
+            self._stopped.wait(max(next_due - time.time(), 0))
+
+    def stop(self):
+        self._stopped.set()
+
+    def _start(self, job, now):
+        job.due = now + job.interval * \
+            (1 + random.uniform(-self.jitter, self.jitter))
+        if job.running:
+            logging.info('Skipping %s, previous run still going', job.name)
+            SKIPPED_RUNS.inc(job=job.name)
+            return
+        job.running = True
+        thread = threading.Thread(target=self._run_job, args=(job,),
+                                  name=job.name)
+        thread.daemon = True
+        thread.start()
+
+    def _run_job(self, job):
+        try:
+            job.function()
+        except Exception:
+            logging.exception('Error in scheduled job %s', job.name)
+        finally:
+            job.running = False
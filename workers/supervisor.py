@@ -0,0 +1,109 @@
+import copy
+import errno
+import logging
+import os
+import signal
+import tempfile
+import time
+
+from workers.manager.port import SharedPortManager
+
+
+def supervise(config, run_worker, processes):
+    """
+    fork worker processes that consume the same queue and share one port
+    ledger, restart those that die and stop them all on SIGTERM, SIGHUP or
+    SIGINT; SIGUSR1 is passed on to toggle profiling. Only the first
+    process runs the heartbeat, the instance updates and the other
+    scheduled jobs; the instance cache is turned off, as the processes
+    change instances behind each other's back.
+    :param config: dict containing the configuration
+    :param run_worker: function taking a config, creating and starting a
+    worker in the current process
+    :param processes: number of worker processes
+    :return: -
+    """
+    config['worker'].setdefault('port_ledger', os.path.join(
+        tempfile.gettempdir(),
+        'metahosting-{}.ports'.format(config['worker']['name'])))
+    SharedPortManager(config['worker'], config['worker']['port_ledger'])\
+        .reset()
+    children = dict()
+    stopping = list()
+
+    def stop(signum, stack):
+        logging.info('Stopping worker processes with signal %s', signum)
+        stopping.append(signum)
+        for pid in children.keys():
+            _kill(pid)
+
+    def start(index):
+        pid = _spawn(config, run_worker, index)
+        children[pid] = index
+        if stopping:
+            # the signal came while the process was being forked
+            _kill(pid)
+
+    def forward(signum, stack):
+        for pid in children.keys():
+            _kill(pid, signum)
+
+    for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGINT):
+        signal.signal(signum, stop)
+    signal.signal(signal.SIGUSR1, forward)
+    for index in range(processes):
+        start(index)
+    while children:
+        try:
+            pid, status = os.wait()
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
+            raise
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logging.error('Worker process %d exited with status %d, restarting',
+                      index, status)
+        time.sleep(1)
+        start(index)
+    logging.info('All worker processes stopped')
+
+
+def _spawn(config, run_worker, index):
+    """
+    :return: pid of the new worker process
+    """
+    pid = os.fork()
+    if pid:
+        logging.info('Started worker process %d as pid %d', index, pid)
+        return pid
+    code = 0
+    try:
+        for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        run_worker(_get_child_config(config, index))
+    except Exception:
+        logging.exception('Worker process %d failed', index)
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def _get_child_config(config, index):
+    child_config = copy.deepcopy(config)
+    child_config['worker']['process_index'] = str(index)
+    child_config['persistence']['cache'] = 'False'
+    if 'metrics_port' in child_config['worker']:
+        child_config['worker']['metrics_port'] = str(
+            int(child_config['worker']['metrics_port']) + index)
+    return child_config
+
+
+def _kill(pid, signum=signal.SIGTERM):
+    try:
+        os.kill(pid, signum)
+    except OSError as err:
+        if err.errno != errno.ESRCH:
+            raise